@@ -1,7 +1,43 @@
 #type: ignore
 from airflow import DAG
 from airflow.providers.standard.operators.bash import BashOperator
-from datetime import datetime
+from datetime import datetime, timedelta
+
+"""
+Daily upload of the mapping files, then one fetch and every report as its own task.
+
+upload_name_mapping ──┐                        ┌─> combined_sales_report ─┐
+                      ├─> fetch_report_inputs ─┼─> report_three_combined ─┼─> cleanup_report_inputs
+upload_sales_category ┘                        └─> ingram_only_pipeline  ─┘
+
+The mapping uploads run first and side by side, the fetch joins the tables they write (INGRAM_MASTER_CATEGORIES,
+MASTER_INGRAM_NAME_MAPPING). fetch_report_inputs reads every source once, builds the sales cube and writes it and the
+lookups to handoff/<ts_nodash> as Parquet (src/helpers/handoff.py), its XCom is the manifest path (the last line main.py
+prints). The reports then run in parallel processes that only read those files, a failed report is retried on its own
+without fetching again. cleanup_report_inputs runs once the reports are done, failed or not, and removes the handoff
+directories older than HANDOFF_KEEP_DAYS (helpers/handoff.prune_inputs), the recent ones stay for clearing a failed report.
+
+Every task is main.py (src/main.py) run through PowerShell in the conda environment, {{ ds }} is the as-of date so a
+cleared or backfilled run rebuilds the reports as of its own date.
+"""
+
+PROJECT_DIR = 'H:\\Upgrading_Database_Reporting_Systems\\REPORTING_PIPELINE'
+HANDOFF_ROOT = f'{PROJECT_DIR}\\handoff'
+HANDOFF_DIR = f'{HANDOFF_ROOT}\\{{{{ ts_nodash }}}}'
+HANDOFF_KEEP_DAYS = 3
+MANIFEST = "{{ ti.xcom_pull(task_ids='fetch_report_inputs') }}"
+
+REPORTS = ['combined_sales_report', 'report_three_combined', 'ingram_only_pipeline']
+
+
+def powershell(command: str) -> str:
+    return f'powershell.exe -Command "cd {PROJECT_DIR}\\src; conda activate reportingenv; {command}"'
+
+
+def main_py(task_id: str, arguments: str) -> str:
+    #tasks run side by side, each gets its own log file and run metrics file
+    return powershell(f"python main.py --skip-uploads --log-file logs_and_tests\\{task_id}.log --run-id {{{{ ts_nodash }}}}_{task_id} {arguments}")
+
 
 default_args = {
     'owner' : 'admin',
@@ -19,8 +55,41 @@ daily_dag = DAG(
     tags = ['sales','daily']
 )
 
-run_daily = BashOperator(
-    task_id='run_daily_pipeline',
-    bash_command='powershell.exe -Command "cd H:\\Upgrading_Database_Reporting_Systems\\REPORTING_PIPELINE\\src; conda activate reportingenv; python run_daily.py"',
+upload_name_mapping = BashOperator(
+    task_id='upload_name_mapping',
+    bash_command=powershell('python database_uploads\\upload_master_name_mapping.py'),
     dag=daily_dag,
-)
\ No newline at end of file
+)
+
+upload_sales_category = BashOperator(
+    task_id='upload_sales_category',
+    bash_command=powershell('python database_uploads\\upload_master_sales_category.py'),
+    dag=daily_dag,
+)
+
+fetch_report_inputs = BashOperator(
+    task_id='fetch_report_inputs',
+    bash_command=main_py('fetch_report_inputs', f"--reports {' '.join(REPORTS)} --as-of {{{{ ds }}}} --write-inputs {HANDOFF_DIR}"),
+    do_xcom_push=True,
+    dag=daily_dag,
+)
+
+report_tasks = [
+    BashOperator(
+        task_id=report,
+        bash_command=main_py(report, f"--reports {report} --read-inputs {MANIFEST}"),
+        retries=2,
+        retry_delay=timedelta(minutes=5),
+        dag=daily_dag,
+    )
+    for report in REPORTS
+]
+
+cleanup_report_inputs = BashOperator(
+    task_id='cleanup_report_inputs',
+    bash_command=powershell(f"python -m helpers.handoff --prune {HANDOFF_ROOT} --keep-days {HANDOFF_KEEP_DAYS}"),
+    trigger_rule='all_done',
+    dag=daily_dag,
+)
+
+[upload_name_mapping, upload_sales_category] >> fetch_report_inputs >> report_tasks >> cleanup_report_inputs
@@ -0,0 +1,94 @@
+#type: ignore
+import os
+import sys
+import argparse
+import subprocess
+
+"""
+Import time budget for the entry points.
+
+Every module in ENTRY_POINTS is imported in a fresh interpreter under python -X importtime (the same numbers the flag
+prints), RUNS times, and the fastest cumulative time is checked against its budget. Two things fail the check:
+
+- a module takes longer than its budget to import (BUDGETS_MS, --budget-ms overrides all of them)
+- a module pulls in one of LAZY_MODULES at import time, those are only imported by the code paths that use them
+
+    cd src
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --budget-ms 1500 --top 15
+
+Exits with status 1 when any entry point is over budget or imports a lazy module, so it can run as a CI or pre deploy step.
+The budgets leave headroom over pandas + SQLAlchemy + Polars, which every entry point needs (~0.9s on the worker).
+"""
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 3
+DEFAULT_BUDGET_MS = 1500
+
+ENTRY_POINTS = [
+    'run_daily',
+    'run_monthly',
+    'main',
+    'pipelines.combined_sales_report',
+    'pipelines.report_three_combined',
+    'pipelines.ingram_only_pipeline',
+    'pipelines.book_level_reports'
+]
+BUDGETS_MS = {module: DEFAULT_BUDGET_MS for module in ENTRY_POINTS}
+
+#optional or Excel only dependencies, imported inside the functions that use them
+LAZY_MODULES = ['xlwings', 'openpyxl', 'dbfread', 'rapidfuzz', 'arrow_odbc', 'psutil']
+
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    {module: (self us, cumulative us, depth)} from -X importtime output, depth 0 is a top level import.
+    """
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        timings.setdefault(name.strip(), (int(self_us), int(cumulative_us), depth))
+    return timings
+
+
+def time_import(module: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        cwd = SRC_DIR, capture_output = True, text = True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr.splitlines()[-1] if result.stderr else ''}")
+    return parse_importtime(result.stderr)
+
+
+def check(modules: list, budgets: dict, runs: int = RUNS, top: int = 10) -> bool:
+    passed = True
+    print(f"{'module':<36} {'import ms':>10} {'budget ms':>10}  lazy modules imported")
+    for module in modules:
+        fastest = min((time_import(module) for _ in range(runs)), key = lambda timings: timings[module][1])
+        import_ms = fastest[module][1] / 1000
+        eager = [name for name in LAZY_MODULES if name in fastest]
+        ok = import_ms <= budgets[module] and not eager
+        passed = passed and ok
+        print(f"{module:<36} {import_ms:>10.0f} {budgets[module]:>10.0f}  {', '.join(eager) or '-'}{'' if ok else '   FAIL'}")
+        if not ok or top:
+            #the direct imports that cost the most, to see what a regression pulled in
+            direct = sorted(((cumulative, name) for name, (self_us, cumulative, depth) in fastest.items() if depth == 1), reverse = True)
+            for cumulative, name in direct[:top]:
+                print(f"    {name:<32} {cumulative / 1000:>10.0f}")
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Check the import time of the entry points against a budget')
+    parser.add_argument('modules', nargs = '*', default = ENTRY_POINTS)
+    parser.add_argument('--budget-ms', type = float, help = 'one budget for every module instead of BUDGETS_MS')
+    parser.add_argument('--runs', type = int, default = RUNS, help = 'imports per module, the fastest one counts')
+    parser.add_argument('--top', type = int, default = 0, help = 'show the N most expensive direct imports of every module')
+    args = parser.parse_args()
+
+    budgets = {module: args.budget_ms or BUDGETS_MS.get(module, DEFAULT_BUDGET_MS) for module in args.modules}
+    sys.exit(0 if check(args.modules, budgets, args.runs, args.top) else 1)
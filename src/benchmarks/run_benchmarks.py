@@ -0,0 +1,179 @@
+#type: ignore
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+import time
+import logging
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+import polars as pl
+from helpers.memory import track_peak_rss
+from helpers import instrumentation
+from helpers.sql_writer import write_sql
+from helpers.dtypes import POLICIES, DTYPE_POLICY, apply_dtype_policy
+from benchmarks.synthetic_data import generate
+from benchmarks.stand_in import stand_in_engine
+
+"""
+Benchmark the report pipelines on synthetic data.
+
+For every scale the harness generates the source frames (benchmarks/synthetic_data.py), seeds the lookup tables into a
+SQLite stand-in for TUTLIV (benchmarks/stand_in.py), then times each stage: the lookup fetches, build_sales_cube and every
+report end to end including its upload. Each stage records wall time, CPU time and peak RSS.
+
+Results are written as one JSON file per run, named after the commit, so runs can be compared across commits:
+
+    cd src
+    python -m benchmarks.run_benchmarks --scales 1 10
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+--dtype-policy wide runs with the Int64/Float64 source rows the pipelines used before helpers/dtypes.py, compare it
+with a compact run for the memory saved.
+"""
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+MB = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def git_revision() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True, text = True, check = True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output = True, text = True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = 'unknown', False
+    return {'commit': commit, 'dirty': dirty}
+
+
+def measure(stages: list, name: str, stage, *args, **kwargs):
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    with track_peak_rss() as usage:
+        result = stage(*args, **kwargs)
+    record = {
+        'stage': name,
+        'wall_s': round(time.perf_counter() - wall_start, 4),
+        'cpu_s': round(time.process_time() - cpu_start, 4),
+        'peak_rss_mb': round(usage['peak_rss'] / MB, 1),
+        'rss_growth_mb': round((usage['peak_rss'] - usage['start_rss']) / MB, 1)
+    }
+    stages.append(record)
+    logger.info(f"  {name:<28} {record['wall_s']:>9.2f}s wall {record['cpu_s']:>9.2f}s cpu {record['peak_rss_mb']:>9.1f} MB peak")
+    return result
+
+
+def seed_lookups(engine, data: dict) -> None:
+    write_sql(data['book_details'], 'BOOK_DETAILS', engine, schema = 'dbo')
+    write_sql(data['all_accounts'], 'ALL_ACCOUNTS_12M_ROLL', engine, schema = 'dbo')
+    write_sql(data['arcus'], 'ARCUS', engine, schema = 'dbo')
+
+
+def ingest(data: dict, policy: str) -> dict:
+    #what load_ing_sales / the SAGE fetch do to the rows they read
+    return {
+        'ingram_sales': apply_dtype_policy(data['ingram_sales'], policy = policy, name = 'ING_SALES'),
+        'sage_sales': apply_dtype_policy(data['sage_sales'], policy = policy, name = 'SAGE_SALES')
+    }
+
+
+def run_scale(scale: float, work_dir: str, dtype_policy: str = DTYPE_POLICY) -> dict:
+    #imported here, the pipeline modules read helpers/paths.py and open their log files on import
+    from pipelines.sales_cube import build_sales_cube
+    from pipelines.combined_sales_report import combined_sales_report, fetch_all_accounts, fetch_book_details
+    from pipelines.report_three_combined import report_three_combined, fetch_customer_city_state
+    from pipelines import ingram_only_pipeline
+
+    logger.info(f"Scale {scale}x")
+    instrumentation.reset()
+    stages = []
+    data = measure(stages, 'generate', generate, scale)
+    engine = stand_in_engine(os.path.join(work_dir, f"scale_{scale}"))
+    measure(stages, 'seed_stand_in', seed_lookups, engine, data)
+
+    all_accounts_df = measure(stages, 'fetch_all_accounts', fetch_all_accounts, engine)
+    book_details_df = measure(stages, 'fetch_book_details', fetch_book_details, engine)
+    customer_city_state = measure(stages, 'fetch_customer_city_state', fetch_customer_city_state, engine)
+
+    data |= measure(stages, 'ingest_dtypes', ingest, data, dtype_policy)
+    sales_cube = measure(stages, 'build_sales_cube', build_sales_cube, ingram_sales_df = data['ingram_sales'], sage_sales_df = data['sage_sales'])
+
+    measure(stages, 'combined_sales_report', combined_sales_report,
+        sales_cube = sales_cube, tutliv_engine = engine, all_accounts_df = all_accounts_df, book_details_df = book_details_df)
+    measure(stages, 'report_three_combined', report_three_combined,
+        sales_cube = sales_cube, target_calculations_df = data['targets'], tutliv_engine = engine, customer_city_state = customer_city_state)
+
+    measure(stages, 'ingram_only_pipeline', ingram_only_pipeline.main, sales_cube = sales_cube, tutliv_engine = engine)
+
+    engine.dispose()
+    return {
+        'scale': scale,
+        'dtype_policy': dtype_policy,
+        'rows': {name: len(df) for name, df in data.items()} | {'sales_cube': len(sales_cube)},
+        'source_mb': {name: round(data[name].estimated_size() / MB, 1) for name in ('ingram_sales', 'sage_sales')},
+        'stages': stages,
+        #the stages each pipeline records itself (helpers/instrumentation.py)
+        'pipeline_stages': instrumentation.run_records()
+    }
+
+
+def run(scales: list, output_dir: str = RESULTS_DIR, dtype_policy: str = DTYPE_POLICY) -> str:
+    results = {
+        **git_revision(),
+        'timestamp': datetime.datetime.now().isoformat(timespec = 'seconds'),
+        'python': platform.python_version(),
+        'polars': pl.__version__,
+        'platform': platform.platform(),
+        'scales': []
+    }
+    with tempfile.TemporaryDirectory(prefix = 'reporting_bench_') as work_dir:
+        for scale in scales:
+            results['scales'].append(run_scale(scale, work_dir, dtype_policy))
+
+    os.makedirs(output_dir, exist_ok = True)
+    stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    output_path = os.path.join(output_dir, f"{results['commit'][:10]}{'_dirty' if results['dirty'] else ''}_{stamp}.json")
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent = 2)
+    logger.info(f"Wrote {output_path}")
+    return output_path
+
+
+def compare(old_path: str, new_path: str) -> None:
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    print(f"old {old['commit'][:10]} ({old['timestamp']})  ->  new {new['commit'][:10]} ({new['timestamp']})")
+    old_stages = {(s['scale'], stage['stage']): stage for s in old['scales'] for stage in s['stages']}
+    print(f"{'scale':>6} {'stage':<28} {'old s':>9} {'new s':>9} {'ratio':>7} {'old MB':>9} {'new MB':>9}")
+    for s in new['scales']:
+        for stage in s['stages']:
+            before = old_stages.get((s['scale'], stage['stage']))
+            if before is None:
+                print(f"{s['scale']:>6} {stage['stage']:<28} {'-':>9} {stage['wall_s']:>9.2f} {'-':>7} {'-':>9} {stage['peak_rss_mb']:>9.1f}")
+                continue
+            ratio = stage['wall_s'] / before['wall_s'] if before['wall_s'] else float('nan')
+            print(f"{s['scale']:>6} {stage['stage']:<28} {before['wall_s']:>9.2f} {stage['wall_s']:>9.2f} {ratio:>6.2f}x {before['peak_rss_mb']:>9.1f} {stage['peak_rss_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Benchmark the report pipelines on synthetic data')
+    parser.add_argument('--scales', nargs = '+', type = float, default = [1, 10], help = 'multiples of production volume, e.g. 1 10 100')
+    parser.add_argument('--output-dir', default = RESULTS_DIR)
+    parser.add_argument('--dtype-policy', choices = sorted(POLICIES), default = DTYPE_POLICY, help = 'ingest dtype policy (helpers/dtypes.py), run wide and compact to compare peak memory')
+    parser.add_argument('--compare', nargs = 2, metavar = ('OLD_JSON', 'NEW_JSON'), help = 'compare two result files instead of running')
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.WARNING, format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger.setLevel(logging.INFO)
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args.scales, args.output_dir, args.dtype_policy)
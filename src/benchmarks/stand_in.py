@@ -0,0 +1,26 @@
+#type: ignore
+import re
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from helpers.sinks import sqlite_engine
+
+"""
+SQLite stand-in for the TUTLIV SQL Server database.
+
+A 'dbo' database is attached to every connection (helpers/sinks.sqlite_engine), so schema='dbo' writes
+(helpers/sql_writer) and dbo.<table> reads work unchanged, and TUTLIV.dbo.<table> in the reports' queries is rewritten
+to dbo.<table> before it is executed.
+Only used by the benchmarks, none of the T-SQL specific queries (DECLARE, sp_rename) run against it.
+"""
+
+THREE_PART_NAME = re.compile(r'TUTLIV\.dbo\.', re.IGNORECASE)
+
+
+def stand_in_engine(directory: str) -> Engine:
+    engine = sqlite_engine(directory)
+
+    @event.listens_for(engine, 'before_cursor_execute', retval = True)
+    def strip_database_name(connection, cursor, statement, parameters, context, executemany):
+        return THREE_PART_NAME.sub('dbo.', statement), parameters
+
+    return engine
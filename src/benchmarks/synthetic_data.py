@@ -0,0 +1,191 @@
+#type: ignore
+import math
+import datetime
+import numpy as np
+import polars as pl
+
+"""
+Deterministic synthetic sales data in the shapes the daily run reads.
+
+ingram_sales    -> helpers/ing_sales_snapshot.load_ing_sales (ING_SALES + TUTTLE_SALES_CATEGORY)
+sage_sales      -> SAGE_QUERY
+targets         -> TARGET_CALCULATION_FILE Sheet1
+book_details, all_accounts, arcus -> the TUTLIV lookup tables the reports join on
+
+Scale 1 is roughly one production run (3 years of history). Row counts grow linearly with scale, ISBN and customer
+counts grow with sqrt(scale) so larger scales also mean more rows per key, the way history grows in production.
+Sales are skewed towards a few popular ISBNs and large accounts (Zipf like weights). The same seed and scale always
+produce the same frames.
+"""
+
+BASE_INGRAM_ROWS = 400_000
+BASE_SAGE_ROWS = 150_000
+BASE_ISBNS = 8_000
+BASE_INGRAM_ACCOUNTS = 3_000
+BASE_SAGE_CUSTOMERS = 1_500
+CATEGORIES = 25
+YEARS = 3
+SEED = 42
+
+
+def history_year_months(as_of: datetime.date, years: int = YEARS) -> list:
+    #every full month the ING/SAGE queries return: YEAR > as_of year - years, current month excluded
+    return [
+        year * 100 + month
+        for year in range(as_of.year - years + 1, as_of.year + 1)
+        for month in range(1, 13)
+        if year * 100 + month < as_of.year * 100 + as_of.month
+    ]
+
+
+def zipf_choice(rng: np.random.Generator, n_keys: int, size: int, exponent: float = 1.1) -> np.ndarray:
+    weights = 1.0 / np.arange(1, n_keys + 1) ** exponent
+    return rng.choice(n_keys, size = size, p = weights / weights.sum())
+
+
+def pick(pool: pl.Series, idx: np.ndarray) -> pl.Series:
+    return pool.gather(idx)
+
+
+def key_pools(rng: np.random.Generator, scale: float) -> dict:
+    key_scale = math.sqrt(scale)
+    n_isbns = int(BASE_ISBNS * key_scale)
+    n_accounts = int(BASE_INGRAM_ACCOUNTS * key_scale)
+    n_customers = int(BASE_SAGE_CUSTOMERS * key_scale)
+
+    isbns = pl.Series([f"978{n:010d}" for n in rng.choice(10**10, size = n_isbns, replace = False)])
+    categories = pl.Series([f"CATEGORY {n:02d}" for n in range(CATEGORIES)])
+    return {
+        'isbns': isbns,
+        'titles': pl.Series([f"TITLE {n}" for n in range(n_isbns)]),
+        'prices': rng.choice([9.99, 12.95, 14.99, 16.99, 19.99, 24.95, 29.99, 39.95], size = n_isbns),
+        'categories': categories,
+        'hq_numbers': pl.Series([f"{20000000 + n}" for n in range(n_accounts)]),
+        'sl_numbers': pl.Series([f"{50000000 + n}" for n in range(n_accounts)]),
+        'account_names': pl.Series([f"INGRAM ACCOUNT {n}" for n in range(n_accounts)]),
+        'account_categories': categories.gather(rng.integers(0, CATEGORIES, size = n_accounts)),
+        'ips_sale': pl.Series(rng.choice(['Y','N'], size = n_accounts, p = [0.2, 0.8])),
+        'sage_ids': pl.Series([f"C{n:06d}" for n in range(n_customers)]),
+        'customer_names': pl.Series([f"SAGE CUSTOMER {n}" for n in range(n_customers)]),
+        'customer_categories': categories.gather(rng.integers(0, CATEGORIES, size = n_customers))
+    }
+
+
+def sales_measures(rng: np.random.Generator, prices: np.ndarray, isbn_idx: np.ndarray) -> tuple:
+    units = rng.integers(1, 40, size = len(isbn_idx))
+    #about 5% of rows are returns
+    units = np.where(rng.random(len(isbn_idx)) < 0.05, -units, units)
+    amounts = np.round(units * prices[isbn_idx] * rng.uniform(0.4, 0.6, size = len(isbn_idx)), 2)
+    return units, amounts
+
+
+def year_month_columns(rng: np.random.Generator, year_months: list, size: int) -> tuple:
+    year_month = np.array(year_months)[rng.integers(0, len(year_months), size = size)]
+    return year_month // 100, year_month % 100
+
+
+def ingram_sales(rng: np.random.Generator, pools: dict, year_months: list, rows: int) -> pl.DataFrame:
+    isbn_idx = zipf_choice(rng, len(pools['isbns']), rows)
+    account_idx = zipf_choice(rng, len(pools['hq_numbers']), rows, exponent = 0.9)
+    units, amounts = sales_measures(rng, pools['prices'], isbn_idx)
+    years, months = year_month_columns(rng, year_months, rows)
+    return pl.DataFrame({
+        'ISBN': pick(pools['isbns'], isbn_idx),
+        'TITLE': pick(pools['titles'], isbn_idx),
+        'NAMECUST': pick(pools['account_names'], account_idx),
+        'YEAR': years,
+        'MONTH': months,
+        'IPS Sale': pick(pools['ips_sale'], account_idx),
+        'NETUNITS': units,
+        'NETAMT': amounts,
+        'HQ Account Number': pick(pools['hq_numbers'], account_idx),
+        'SL Account Number': pick(pools['sl_numbers'], account_idx),
+        'TUTTLE_SALES_CATEGORY': pick(pools['account_categories'], account_idx)
+    })
+
+
+def sage_sales(rng: np.random.Generator, pools: dict, year_months: list, rows: int) -> pl.DataFrame:
+    isbn_idx = zipf_choice(rng, len(pools['isbns']), rows)
+    customer_idx = zipf_choice(rng, len(pools['sage_ids']), rows, exponent = 0.9)
+    units, amounts = sales_measures(rng, pools['prices'], isbn_idx)
+    years, months = year_month_columns(rng, year_months, rows)
+    return pl.DataFrame({
+        'SAGE_ID': pick(pools['sage_ids'], customer_idx),
+        'ISBN': pick(pools['isbns'], isbn_idx),
+        'YEAR': years,
+        'MONTH': months,
+        'TITLE': pick(pools['titles'], isbn_idx),
+        'NAMECUST': pick(pools['customer_names'], customer_idx),
+        'NETUNITS': units,
+        'NETAMT': amounts,
+        'TUTTLE_SALES_CATEGORY': pick(pools['customer_categories'], customer_idx)
+    })
+
+
+def targets(rng: np.random.Generator, pools: dict) -> pl.DataFrame:
+    #targets exist for the larger accounts only, like the real workbook
+    billto = pl.concat([pools['hq_numbers'].head(len(pools['hq_numbers']) // 5), pools['sage_ids'].head(len(pools['sage_ids']) // 5)])
+    names = pl.concat([pools['account_names'].head(len(pools['hq_numbers']) // 5), pools['customer_names'].head(len(pools['sage_ids']) // 5)])
+    return pl.DataFrame({
+        'BILLTO': billto,
+        'COMPANY': names,
+        '2024': np.round(rng.uniform(1_000, 500_000, size = len(billto)), 2),
+        '2025': np.round(rng.uniform(1_000, 500_000, size = len(billto)), 2),
+        'MUL_RATIO': np.round(rng.uniform(0.9, 1.3, size = len(billto)), 3),
+        'Dupe?': pl.Series([None] * len(billto), dtype = pl.Utf8)
+    })
+
+
+def book_details(rng: np.random.Generator, pools: dict) -> pl.DataFrame:
+    n = len(pools['isbns'])
+    sub_pub = rng.choice(['TUT','PER','CHE'], size = n)
+    webcat = rng.integers(100, 140, size = n)
+    return pl.DataFrame({
+        'ISBN': pools['isbns'],
+        'PROD_TYPE': rng.choice(['HC','TP','BD'], size = n),
+        'PROD_CLASS': rng.choice(['FRONT','BACK'], size = n),
+        'PUB_STATUS': rng.choice(['ACT','OP','NYP'], size = n, p = [0.8, 0.15, 0.05]),
+        'SEAS': rng.choice(['S24','F24','S25','F25'], size = n),
+        'SUB_PUB': sub_pub,
+        'SUBPUB': sub_pub,
+        'RETAIL_PRICE': pools['prices'],
+        'WEBCAT2': [f"W{code}" for code in webcat],
+        'WEBCAT2_DESCR': [f"WEB CATEGORY {code}" for code in webcat]
+    })
+
+
+def all_accounts(rng: np.random.Generator, pools: dict) -> pl.DataFrame:
+    n = len(pools['isbns'])
+    units = rng.integers(0, 5_000, size = n)
+    return pl.DataFrame({
+        'ITEMNO': pools['isbns'],
+        'NETQTY': units,
+        'NETSALES': np.round(units * pools['prices'] * 0.5, 2)
+    })
+
+
+def arcus(rng: np.random.Generator, pools: dict) -> pl.DataFrame:
+    names = pl.concat([pools['customer_names'], pools['account_names']])
+    return pl.DataFrame({
+        'NAMECUST': names,
+        'NAMECITY': [f"CITY {n}" for n in rng.integers(0, 400, size = len(names))],
+        'CODESTTE': rng.choice(['VT','NY','CA','TX','MA','WA'], size = len(names))
+    })
+
+
+def generate(scale: float = 1, as_of: datetime.date = None, seed: int = SEED) -> dict:
+    """
+    All synthetic frames for one scale, keyed by the names used in benchmarks/run_benchmarks.py.
+    """
+    as_of = as_of or datetime.date.today()
+    rng = np.random.default_rng(seed)
+    pools = key_pools(rng, scale)
+    year_months = history_year_months(as_of)
+    return {
+        'ingram_sales': ingram_sales(rng, pools, year_months, int(BASE_INGRAM_ROWS * scale)),
+        'sage_sales': sage_sales(rng, pools, year_months, int(BASE_SAGE_ROWS * scale)),
+        'targets': targets(rng, pools),
+        'book_details': book_details(rng, pools),
+        'all_accounts': all_accounts(rng, pools),
+        'arcus': arcus(rng, pools)
+    }
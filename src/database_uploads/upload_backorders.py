@@ -1,17 +1,16 @@
 #type: ignore
 import pandas as pd
-import sqlalchemy
-import pyodbc
 import logging
 import os,sys
-import urllib
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from helpers.paths import PATHS
-from sqlalchemy.engine import Engine
+from helpers.engine import get_engine
+from helpers.sql_writer import publish_sql
+from helpers.instrumentation import stage, reset, finish_run
+from helpers.isbn import normalize_isbn_series, invalid_isbn_count
 import logging
 
 BACKORDER_REPORT_PATH = PATHS["BACKORDER_REPORT_PATH"]
-SSMS_CONN_STRING = PATHS["SSMS_CONN_STRING"]
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,13 +22,14 @@ logging.basicConfig(
 )
 
 def backorder_report() -> None:
-    params = urllib.parse.quote_plus(SSMS_CONN_STRING)
-    tutliv_engine = sqlalchemy.create_engine(f"mssql+pyodbc:///?odbc_connect={params}",connect_args={'timeout':1800,'connect_timeout':120},pool_recycle=3600)
+    tutliv_engine = get_engine()
 
-    ing_backorders = pd.read_excel(BACKORDER_REPORT_PATH, header=0, dtype = {
-        'EAN' : str,
-        'Open Backorder' : int
-    })
+    with stage('BACKORDER_REPORT', 'fetch') as s:
+        ing_backorders = pd.read_excel(BACKORDER_REPORT_PATH, header=0, dtype = {
+            'EAN' : str,
+            'Open Backorder' : int
+        })
+        s['rows_out'] = len(ing_backorders)
 
     #filter titles with no backorders
     ing_backorders = ing_backorders[ing_backorders['Open Backorder'] != 0]
@@ -68,6 +68,12 @@ def backorder_report() -> None:
     except Exception as e:
         logging.info(f'exception occured while {e}')
     
+    ing_backorders['ISBN'] = normalize_isbn_series(ing_backorders['ISBN'])
+    sage_backorders['ISBN'] = normalize_isbn_series(sage_backorders['ISBN'])
+    invalid_isbns = invalid_isbn_count(ing_backorders['ISBN'])
+    if invalid_isbns:
+        logging.warning(f"Found {invalid_isbns} Ingram backorder EANs that are not valid ISBN-13s")
+
     #group ingram and sage backorders by ISBN,TITLE and SUM QTY
     ing_backorders = ing_backorders.groupby(['TITLE','ISBN']).agg({
         'QTY':'sum'
@@ -82,9 +88,14 @@ def backorder_report() -> None:
         'QTY' : 'sum'
     }).reset_index()
 
-    all_backorders.to_sql('BACKORDER_REPORT',con=tutliv_engine,schema='dbo',index = False,if_exists='replace')
+    with stage('BACKORDER_REPORT', 'upload', rows_in = len(all_backorders)) as s:
+        s['rows_out'] = publish_sql(all_backorders,'BACKORDER_REPORT',engine=tutliv_engine,schema='dbo',indexes=[['ISBN']])
         
 if __name__ == "__main__":
+    reset(suffix = 'backorders')
     logging.info('Manual Execution Started')
-    backorder_report()
+    try:
+        backorder_report()
+    finally:
+        finish_run('logs_and_tests', get_engine())
     logging.info('backorder report upload complete')
@@ -1,60 +1,59 @@
 #type: ignore
 import pandas as pd
-import xlwings as xw
-import sqlalchemy
-import openpyxl
-import pyodbc
 import logging
-import os,urllib,sys
+import os,sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from helpers.paths import PATHS
+from helpers.engine import get_engine
+from helpers.excel_reader import read_sheets
+from helpers.instrumentation import stage, reset, finish_run
+from helpers.upload_manifest import source_unchanged, table_unchanged, record_upload
 
 
 
 logger = logging.getLogger(__name__)
 
-SSMS_CONN_STRING = PATHS["SSMS_CONN_STRING"]
 MASTER_NAME_MAPPING_FILE = PATHS["MASTER_NAME_MAPPING_FILE"]
+SHEET = 'INGRAM_NAMES'
+TABLE = 'MASTER_INGRAM_NAME_MAPPING'
 
-params = urllib.parse.quote_plus(SSMS_CONN_STRING)
-engine = sqlalchemy.create_engine(f"mssql+pyodbc:///?odbc_connect={params}",connect_args={'timeout':1800,'connect_timeout':120},pool_recycle=3600)
 
+def main(force: bool = False):
+    engine = get_engine()
+    #the workbook changes a few times a month, skip the read and the upload when it has not (force uploads anyway)
+    if not force and source_unchanged(MASTER_NAME_MAPPING_FILE, [TABLE], engine):
+        return
 
-def main():
     try:
-        app = xw.App(visible = False)
-        wb = app.books.open(MASTER_NAME_MAPPING_FILE)
-        ws = wb.sheets['INGRAM_NAMES']
-        last_row = ws.range("A1").end('down').row
         logger.info("Starting load")
-        name_mapping_df = ws.range(f"A1:I{last_row}").options(pd.DataFrame,header=True,index = False).value
+        with stage('NAME_MAPPING', 'fetch') as s:
+            name_mapping_df = read_sheets(MASTER_NAME_MAPPING_FILE, {SHEET: 'I'})[SHEET]
+            s['rows_out'] = len(name_mapping_df)
         logger.info(f"Loaded columns: {list(name_mapping_df.columns)}")
-        wb.close()
         logger.info("Successfully loaded name mapping data from Excel")
     except Exception as e:
         logger.info(f"failedto load name mapping {e}")
-    finally:
-        if app is not None:
-            try:
-                logger.info("Closing Excel application")
-                app.quit()
-                logger.info("Excel application closed successfully")
-            except Exception as e:
-                logger.warning(f"Error closing Excel app: {e}")
+        name_mapping_df = pd.DataFrame()
 
 
     #Upload
 
     if not name_mapping_df.empty:
+        if not force and table_unchanged(MASTER_NAME_MAPPING_FILE, TABLE, name_mapping_df):
+            record_upload(MASTER_NAME_MAPPING_FILE, SHEET, TABLE, name_mapping_df)
+            return
         try:
-            name_mapping_df.to_sql(
-                'MASTER_INGRAM_NAME_MAPPING', 
-                engine, 
-                schema='dbo', 
-                index=False, 
-                if_exists='replace'
-            )
-            logger.info(f"successfully uploaded {len(name_mapping_df)} rows to SQL Server Table: MASTER_INGRAM_NAME_MAPPING")
+            with stage('NAME_MAPPING', 'upload', rows_in = len(name_mapping_df)) as s:
+                name_mapping_df.to_sql(
+                    TABLE, 
+                    engine, 
+                    schema='dbo', 
+                    index=False, 
+                    if_exists='replace'
+                )
+                s['rows_out'] = len(name_mapping_df)
+            logger.info(f"successfully uploaded {len(name_mapping_df)} rows to SQL Server Table: {TABLE}")
+            record_upload(MASTER_NAME_MAPPING_FILE, SHEET, TABLE, name_mapping_df)
         except Exception as e:
             logger.info(f"failed to upload to SQL server {e}")
     else:
@@ -68,8 +67,12 @@ if __name__ == "__main__":
         logging.StreamHandler(sys.stdout)
     ]
 )
+    reset(suffix = 'name_mapping')
     logger.info('starting upload_master_name_mapping.py')
-    main()
+    try:
+        main()
+    finally:
+        finish_run('logs_and_tests', get_engine())
     logger.info('successfully finished upload_master_name_mapping.py')
 
 
@@ -1,84 +1,53 @@
 #type: ignore
 import pandas as pd
-import sqlalchemy
-import xlwings as xw
-import urllib,os,sys,logging
+import os,sys,logging
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from helpers.paths import PATHS
+from helpers.engine import get_engine
+from helpers.excel_reader import read_sheets
+from helpers.instrumentation import stage, reset, finish_run
+from helpers.upload_manifest import source_unchanged, table_unchanged, record_upload
 
 MASTER_SALES_CATEGORIES = PATHS["MASTER_SALES_CATEGORIES"]
-SSMS_CONN_STRING = PATHS["SSMS_CONN_STRING"]
-params = urllib.parse.quote_plus(SSMS_CONN_STRING)
-engine = sqlalchemy.create_engine(f"mssql+pyodbc:///?odbc_connect={params}",connect_args={'timeout':1800,'connect_timeout':120},pool_recycle=3600)
+#sheet -> (last column, table it is uploaded to)
+SHEETS = {
+    'INGRAM_CUSTOMERS': ('E', 'INGRAM_MASTER_CATEGORIES'),
+    'SAGE_CUSTOMERS': ('D', 'SAGE_MASTER_CATEGORIES')
+}
 
 
 logger = logging.getLogger(__name__)
 
 
-def main():
-    try:
-        app = xw.App(visible = False)
-        logger.info(f"Opening Excel file: {MASTER_SALES_CATEGORIES}")
-        wb = app.books.open(MASTER_SALES_CATEGORIES,update_links= False)
-        
-        logger.info("Accessing INGRAM_CUSTOMERS sheet")
-        ws = wb.sheets["INGRAM_CUSTOMERS"]
-        
-        logger.info("Reading data from Excel sheet")
-        last_row = ws.range('A1').end('down').row
-        ingram_master_sales_categories: pd.DataFrame = ws.range(f'A1:E{last_row}').options(pd.DataFrame, header=True, index=False, dtype=str).value
-        
-        logger.info(f"Successfully loaded {len(ingram_master_sales_categories)} rows from Excel")
-        
-        
-        wb.save()
-        wb.close()
-        logger.info('Successfully loaded ingram categories from Excel')
-        
-    except Exception as e:
-        logger.error(f"Failed to load ingram categories: {e}")
-        if 'wb' in locals():
-            try:
-                wb.close()
-            except:
-                pass
-        if app is not None:
-            app.quit()
-        sys.exit(1)
-    finally:
-        app.quit()
+def main(force: bool = False):
+    engine = get_engine()
+    #the workbook changes a few times a month, skip the read and the uploads when it has not (force uploads anyway)
+    if not force and source_unchanged(MASTER_SALES_CATEGORIES, [table for last_column, table in SHEETS.values()], engine):
+        return
 
+    #both sheets are read from one open of the workbook
     try:
-        app1 = xw.App(visible = False)
-        wb = app1.books.open(MASTER_SALES_CATEGORIES, update_links = False)
-        ws = wb.sheets['SAGE_CUSTOMERS']
-        last_row = ws.range('A1').end('down').row
-        logger.info("Loading SAGE categories")
-        sage_master_categories : pd.DataFrame = ws.range(f"A1:D{last_row}").options(pd.DataFrame, header=True, index=False, dtype=str).value
-            
-        logger.info("Successfully loaded SAGE categories")
+        logger.info(f"Opening Excel file: {MASTER_SALES_CATEGORIES}")
+        with stage('SALES_CATEGORY_MAPPING', 'fetch') as s:
+            sheets = read_sheets(MASTER_SALES_CATEGORIES, {sheet: last_column for sheet, (last_column, table) in SHEETS.items()}, dtype = str)
+            s['rows_out'] = sum(len(sheet_df) for sheet_df in sheets.values())
+        logger.info(f"Successfully loaded {len(sheets['INGRAM_CUSTOMERS'])} ingram categories and {len(sheets['SAGE_CUSTOMERS'])} SAGE categories from Excel")
     except Exception as e:
-        logger.error(f"Failed to load SAGE categories {e}")
-        if 'wb' in locals():
-            try:
-                wb.close()
-            except Exception as e:
-                logging.info(f"Faled to close wb during SAGE categories trycatch : {e}")
-                pass
-        if app1 is not None:
-            app1.quit()
+        logger.error(f"Failed to load master sales categories: {e}")
         sys.exit(1)
-    finally:
-        app1.quit()
 
-    # Upload to SQL Server
+    # Upload to SQL Server, only the sheets whose rows changed
     try:
         logger.info("Uploading data to SQL Server...")
-        ingram_master_sales_categories.to_sql('INGRAM_MASTER_CATEGORIES', engine, index=False, if_exists='replace', schema='dbo')
-        logger.info(f'Successfully uploaded {len(ingram_master_sales_categories)} rows to SQL Server table INGRAM_MASTER_CATEGORIES')
-        sage_master_categories.to_sql("SAGE_MASTER_CATEGORIES",engine,index=False,if_exists='replace',schema='dbo')
-        logger.info(f"Successfully uploaded {len(sage_master_categories)} rows to SQL Server table SAGE_MASTER_CATEOGRIES")
+        for sheet, (last_column, table) in SHEETS.items():
+            categories_df: pd.DataFrame = sheets[sheet]
+            if force or not table_unchanged(MASTER_SALES_CATEGORIES, table, categories_df):
+                with stage('SALES_CATEGORY_MAPPING', f'upload {table}', rows_in = len(categories_df)) as s:
+                    categories_df.to_sql(table, engine, index=False, if_exists='replace', schema='dbo')
+                    s['rows_out'] = len(categories_df)
+                logger.info(f'Successfully uploaded {len(categories_df)} rows to SQL Server table {table}')
+            record_upload(MASTER_SALES_CATEGORIES, sheet, table, categories_df)
     except Exception as e:
         logger.error(f"Failed to upload to SQL Server: {str(e)}")
         sys.exit(1)
@@ -92,6 +61,10 @@ if __name__ == "__main__":
         logging.StreamHandler(sys.stdout)
     ]
 )
+    reset(suffix = 'sales_category_mapping')
     logger.info('starting upload_master_sales_categories')
-    main()
+    try:
+        main()
+    finally:
+        finish_run('logs_and_tests', get_engine())
     logger.info('finished upload_master_sales_categories')
\ No newline at end of file
@@ -0,0 +1,26 @@
+#type: ignore
+import polars as pl
+
+"""
+Dictionary encoded string columns for the report pipelines.
+
+Customer names, categories, titles and account numbers repeat on every ISBN x customer x month row of the sales cube.
+encode_categoricals casts them to Categorical, so every group_by and join on them hashes and compares integer codes and
+each distinct string is stored once. Polars keeps one global category mapping, so the codes of two encoded frames line
+up and they can be joined directly (a string column has to be encoded before it is joined to an encoded one).
+
+decode_categoricals turns them back into plain strings, helpers/sql_writer.write_sql decodes every frame before it is
+written, so the tables on SQL Server are unchanged. Anything that does string work on an encoded column (concatenation,
+str.* functions, pandas) casts it back to pl.Utf8 first.
+"""
+
+CATEGORICAL_COLUMNS = ['HQ_NUMBER','SL_NUMBER','SAGE_ID','IPS_SALE','TITLE','NAMECUST','TUTTLE_SALES_CATEGORY']
+
+
+def encode_categoricals(frame, columns: list = CATEGORICAL_COLUMNS):
+    present = [col for col in columns if col in frame.collect_schema().names()]
+    return frame.with_columns(pl.col(present).cast(pl.Categorical))
+
+
+def decode_categoricals(frame):
+    return frame.with_columns(pl.col(pl.Categorical, pl.Enum).cast(pl.Utf8))
@@ -0,0 +1,110 @@
+#type: ignore
+import logging
+import polars as pl
+from helpers.paths import PATHS
+
+logger = logging.getLogger(__name__)
+
+"""
+Dtype policy for the sales rows as they are ingested.
+
+The raw ING_SALES / ALL_HSA_MKSEG / book level rows come back from SQL Server as Int64 periods and units and Float64
+amounts. Under the 'compact' policy (the default) apply_dtype_policy stores them as:
+
+period    YEAR, MONTH, YEARMONTH    Int32
+units     NETUNITS, NETQTY          Int32
+amount    NETAMT -> NETAMT_CENTS    Int64 whole cents, exact, so summing millions of rows does not drift
+
+An amount is renamed to <column>_CENTS when it is stored in cents, so no reader can take cents for dollars. The cube and the
+reports convert back at their boundary: amount_total sums the cents as integers and divides once, amount_dollars gives
+the per row amount. Both take the plain Float64 column when the rows are not in cents ('wide', or a column that kept its
+wide type).
+
+Every downcast is checked first: a column with a value that overflows the compact type, or an amount that is not a whole
+number of cents, keeps its wide type and a warning is logged, nothing is silently rounded. 'wide' keeps Int64/Float64.
+
+Polars does not widen Int32 sums (they wrap at 2**31), so anything summing compact units sums them as Int64,
+see pipelines/sales_cube.aggregate_sales.
+"""
+
+DTYPE_POLICY = PATHS.get("DTYPE_POLICY", "compact")
+
+#amounts under the compact policy are stored as Int64 whole cents in <column>_CENTS
+CENTS = 'cents'
+CENTS_SUFFIX = '_CENTS'
+
+POLICIES = {
+    'compact': {'period': pl.Int32, 'units': pl.Int32, 'amount': CENTS},
+    'wide': {'period': pl.Int64, 'units': pl.Int64, 'amount': pl.Float64}
+}
+
+SALES_COLUMN_ROLES = {
+    'YEAR': 'period',
+    'MONTH': 'period',
+    'YEARMONTH': 'period',
+    'NETUNITS': 'units',
+    'NETQTY': 'units',
+    'NETAMT': 'amount'
+}
+
+#an amount is a whole number of cents when its cents give it back within this (float noise from SQL Server / Excel)
+AMOUNT_TOLERANCE = 1e-6
+MB = 1024 * 1024
+
+
+def cast_column(column: str, dtype) -> pl.Expr:
+    if dtype is CENTS:
+        #through Float64, Polars rounds Decimal straight to an integer
+        return (pl.col(column).cast(pl.Float64) * 100).round().cast(pl.Int64, strict = False).alias(column + CENTS_SUFFIX)
+    return pl.col(column).cast(dtype, strict = False)
+
+
+def lossy_rows(column: str, dtype) -> pl.Expr:
+    #rows the cast would null (overflow, unparsable) or change by more than the tolerance
+    cast = cast_column(column, dtype)
+    value = cast.cast(pl.Float64) / 100 if dtype is CENTS else cast.cast(pl.Float64)
+    changed = (value - pl.col(column).cast(pl.Float64)).abs() > AMOUNT_TOLERANCE
+    return ((cast.is_null() & pl.col(column).is_not_null()) | changed.fill_null(False)).sum().alias(column)
+
+
+def amount_dollars(column: str, columns: list) -> pl.Expr:
+    """
+    The per row amount of column in Float64 dollars, from <column>_CENTS when the rows carry it.
+    """
+    if column + CENTS_SUFFIX in columns:
+        return (pl.col(column + CENTS_SUFFIX).cast(pl.Float64) / 100).alias(column)
+    return pl.col(column).cast(pl.Float64)
+
+
+def amount_total(column: str, columns: list) -> pl.Expr:
+    """
+    The sum of column in Float64 dollars. Cents are summed as integers and divided once, so the total is exact.
+    """
+    if column + CENTS_SUFFIX in columns:
+        return (pl.col(column + CENTS_SUFFIX).sum() / 100).alias(column)
+    return pl.col(column).cast(pl.Float64).sum().alias(column)
+
+
+def apply_dtype_policy(frame: pl.DataFrame, roles: dict = SALES_COLUMN_ROLES, policy: str = DTYPE_POLICY, name: str = 'frame') -> pl.DataFrame:
+    """
+    Cast the columns of frame named in roles ({column: 'period' | 'units' | 'amount'}) to the policy's dtypes,
+    columns that are not on the frame are skipped. Amounts stored in cents replace their column with <column>_CENTS.
+    Logs the frame's size before and after.
+    """
+    dtypes = POLICIES[policy]
+    targets = {col: dtypes[role] for col, role in roles.items() if col in frame.columns and frame.schema[col] != dtypes[role]}
+    if not targets:
+        return frame
+
+    lossy = frame.select([lossy_rows(col, dtype) for col, dtype in targets.items()]).row(0, named = True)
+    casts = {}
+    for col, dtype in targets.items():
+        if lossy[col]:
+            logger.warning(f"{name}: {lossy[col]} {col} values do not fit {dtype}, keeping {frame.schema[col]}")
+        else:
+            casts[col] = cast_column(col, dtype)
+
+    size_before = frame.estimated_size()
+    frame = frame.select([casts.get(col, pl.col(col)) for col in frame.columns])
+    logger.info(f"{name}: {policy} dtypes {size_before / MB:.1f} MB -> {frame.estimated_size() / MB:.1f} MB")
+    return frame
@@ -0,0 +1,59 @@
+#type: ignore
+import atexit
+import logging
+import threading
+import urllib.parse
+import sqlalchemy
+from sqlalchemy.engine import Engine
+from helpers.paths import PATHS
+
+logger = logging.getLogger(__name__)
+
+"""
+The one SQLAlchemy engine for TUTLIV.
+
+get_engine() creates the mssql+pyodbc engine on first use and hands the same engine to every caller after that, so
+importing a pipeline or an upload script no longer opens its own pool (and nothing is created until a query runs).
+The pool checks connections before handing them out (pool_pre_ping, the nightly jobs outlive SQL Server's idle
+timeouts) and is sized for the busiest part of a run: prefetch reads every source at once (6 in run_daily) while the
+reports upload side by side. The engine is disposed at interpreter exit.
+
+ENGINE_POOL_SIZE and ENGINE_MAX_OVERFLOW in helpers/paths.py override the pool size.
+"""
+
+POOL_SIZE = int(PATHS.get("ENGINE_POOL_SIZE", 8))
+MAX_OVERFLOW = int(PATHS.get("ENGINE_MAX_OVERFLOW", 4))
+
+engine = None
+engine_lock = threading.Lock()
+
+
+def create_engine() -> Engine:
+    params = urllib.parse.quote_plus(PATHS["SSMS_CONN_STRING"])
+    return sqlalchemy.create_engine(
+        f"mssql+pyodbc:///?odbc_connect={params}",
+        connect_args = {'timeout': 1800, 'connect_timeout': 120},
+        pool_recycle = 3600,
+        pool_pre_ping = True,
+        pool_size = POOL_SIZE,
+        max_overflow = MAX_OVERFLOW
+    )
+
+
+def get_engine() -> Engine:
+    global engine
+    #prefetch threads can ask for it at the same time
+    with engine_lock:
+        if engine is None:
+            engine = create_engine()
+            atexit.register(dispose_engine)
+            logger.info(f"Created TUTLIV engine (pool size {POOL_SIZE} + {MAX_OVERFLOW} overflow)")
+        return engine
+
+
+def dispose_engine() -> None:
+    global engine
+    with engine_lock:
+        if engine is not None:
+            engine.dispose()
+            engine = None
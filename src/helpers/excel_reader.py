@@ -0,0 +1,94 @@
+#type: ignore
+import logging
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+"""
+Headless reader for the mapping workbooks.
+
+read_sheets opens a workbook once with openpyxl in read only mode and reads every requested sheet in that one pass, no
+Excel instance is started so it also runs on Linux. Each sheet is read the way the xlwings uploads read it:
+ws.range(f"A1:{last_column}{last_row}") with last_row = A1.end('down'), header row first, numbers as floats (xlwings
+returns every number as a float), empty cells as None, then astype(dtype) when a dtype is given.
+
+xlwings is only used as a fallback when openpyxl cannot open the file (e.g. a legacy .xls or a workbook locked by Excel),
+any other error (a missing sheet, a bad header) is raised as it is: xlwings is not installed on the Linux workers and its
+ImportError would hide the real error. Both are imported when a workbook is read, importing the upload scripts does not
+load either.
+"""
+
+
+def block_to_frame(rows: list, dtype = None) -> pd.DataFrame:
+    #rows[0] is the header row, same conversion as xlwings' options(pd.DataFrame, header = True, index = False)
+    df = pd.DataFrame(rows[1:], columns = rows[0])
+    if dtype is not None:
+        df = df.astype(dtype)
+    return df
+
+
+def excel_value(value):
+    #openpyxl keeps whole numbers as int, xlwings reads every number as a float
+    if isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def read_sheet_openpyxl(ws, last_column: str) -> list:
+    from openpyxl.utils import column_index_from_string
+    rows = []
+    for row in ws.iter_rows(min_row = 1, max_col = column_index_from_string(last_column), values_only = True):
+        #the block ends at the first empty cell in column A, like A1.end('down')
+        if row[0] is None:
+            break
+        rows.append([excel_value(value) for value in row])
+    return rows
+
+
+def read_sheets_openpyxl(path: str, sheets: dict, dtype = None) -> dict:
+    import openpyxl
+    wb = openpyxl.load_workbook(path, read_only = True, data_only = True)
+    try:
+        return {name: block_to_frame(read_sheet_openpyxl(wb[name], last_column), dtype) for name, last_column in sheets.items()}
+    finally:
+        wb.close()
+
+
+def read_sheets_xlwings(path: str, sheets: dict, dtype = None) -> dict:
+    import xlwings as xw
+    app = xw.App(visible = False)
+    try:
+        wb = app.books.open(path, update_links = False, read_only = True)
+        frames = {}
+        for name, last_column in sheets.items():
+            ws = wb.sheets[name]
+            last_row = ws.range('A1').end('down').row
+            frames[name] = ws.range(f"A1:{last_column}{last_row}").options(pd.DataFrame, header = True, index = False, dtype = dtype).value
+        wb.close()
+        return frames
+    finally:
+        app.quit()
+
+
+def open_errors() -> tuple:
+    #what openpyxl raises for a workbook it cannot open at all
+    from zipfile import BadZipFile
+    from openpyxl.utils.exceptions import InvalidFileException
+    return (InvalidFileException, BadZipFile, PermissionError)
+
+
+def read_sheets(path: str, sheets: dict, dtype = None) -> dict:
+    """
+    sheets maps a sheet name to the last column of its block, e.g. {'INGRAM_CUSTOMERS': 'E', 'SAGE_CUSTOMERS': 'D'}.
+    Returns {sheet name: pd.DataFrame}.
+    """
+    try:
+        return read_sheets_openpyxl(path, sheets, dtype)
+    except open_errors() as e:
+        logger.warning(f"openpyxl could not open {path} ({e!r}), falling back to xlwings")
+        open_error = e
+    try:
+        return read_sheets_xlwings(path, sheets, dtype)
+    except Exception:
+        logger.error(f"xlwings could not read {path} either, openpyxl failed with: {open_error!r}", exc_info = open_error)
+        raise
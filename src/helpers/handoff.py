@@ -0,0 +1,102 @@
+#type: ignore
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import datetime
+import pandas as pd
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+"""
+Hand the fetched report inputs from one process to the next through Parquet.
+
+The Airflow DAG (airflow/dags/run_daily_dag.py) fetches once and runs every report as its own task. The fetch task
+writes the sales cube and the lookups with write_inputs, and only the manifest path goes through XCom. Each report
+task reads its inputs back with read_inputs. A failed report can be retried without fetching again.
+
+Layout:
+<directory>/_inputs.json      {"as_of": "YYYY-MM-DD", "files": {name: parquet path}, "pandas": [names read back as pandas]}
+<directory>/<name>.parquet
+
+Nothing is removed when the reports finish, so a failed report task can still be cleared and rerun on its inputs.
+prune_inputs removes the run directories under a hand-off root that are older than KEEP_DAYS, the DAG's last task runs it
+(python -m helpers.handoff --prune <root>) whether or not the reports succeeded.
+
+Polars frames keep their dtypes (Categorical, Enum, Decimal) through the round trip. pandas frames (the ARCUS lookup)
+are written through Polars and come back as pandas.
+"""
+
+MANIFEST_FILE = '_inputs.json'
+#days a run directory is kept for retries and reruns
+KEEP_DAYS = 3
+
+
+def write_inputs(inputs: dict, directory: str, as_of: datetime.date) -> str:
+    """
+    Write every frame in inputs ({name: Polars or pandas frame}) to directory, returns the manifest path.
+    """
+    os.makedirs(directory, exist_ok = True)
+    manifest = {'as_of': as_of.isoformat(), 'files': {}, 'pandas': []}
+    for name, df in inputs.items():
+        if isinstance(df, pd.DataFrame):
+            manifest['pandas'].append(name)
+            df = pl.from_pandas(df)
+        path = os.path.abspath(os.path.join(directory, f"{name}.parquet"))
+        df.write_parquet(path)
+        manifest['files'][name] = path
+        logger.info(f"Handed off {name}: {len(df)} rows to {path}")
+
+    manifest_path = os.path.abspath(os.path.join(directory, MANIFEST_FILE))
+    #the manifest is written last, a fetch that failed half way leaves no manifest to read
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent = 2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest_path
+
+
+def read_inputs(manifest_path: str, names: list = None) -> tuple:
+    """
+    (inputs, as_of) from a manifest written by write_inputs, only the frames in names when given.
+    """
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    inputs = {}
+    for name, path in manifest['files'].items():
+        if names is not None and name not in names:
+            continue
+        df = pl.read_parquet(path)
+        inputs[name] = df.to_pandas() if name in manifest['pandas'] else df
+        logger.info(f"Read {name}: {len(df)} rows from {path}")
+    return inputs, datetime.date.fromisoformat(manifest['as_of'])
+
+
+def prune_inputs(root: str, keep_days: float = KEEP_DAYS) -> list:
+    """
+    Remove the run directories under root last written more than keep_days ago, returns the removed paths.
+    """
+    if not os.path.isdir(root):
+        return []
+    cutoff = time.time() - keep_days * 24 * 60 * 60
+    removed = []
+    for entry in os.scandir(root):
+        #a fetch that failed half way leaves a directory without a manifest, it is pruned the same way
+        if entry.is_dir(follow_symlinks = False) and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors = True)
+            removed.append(entry.path)
+            logger.info(f"Removed hand-off directory {entry.path}")
+    return removed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level = logging.INFO, format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s', handlers = [logging.StreamHandler(sys.stdout)])
+    parser = argparse.ArgumentParser(description = 'Remove old report input hand-off directories')
+    parser.add_argument('--prune', required = True, metavar = 'ROOT', help = 'directory holding one hand-off directory per run')
+    parser.add_argument('--keep-days', type = float, default = KEEP_DAYS)
+    args = parser.parse_args()
+    removed = prune_inputs(args.prune, args.keep_days)
+    logger.info(f"Removed {len(removed)} hand-off directories older than {args.keep_days} days from {args.prune}")
@@ -0,0 +1,138 @@
+#type: ignore
+import os
+import logging
+import tempfile
+import datetime
+import pandas as pd
+import polars as pl
+from helpers.paths import PATHS
+from helpers.isbn import invalid_isbn_count
+
+logger = logging.getLogger(__name__)
+
+"""
+Streaming ingest of the Ingram sales Excel exports (MONTHLY_ING_SALES, HISTORICAL_ING_SALES).
+
+The sheet is read in row chunks with openpyxl in read only mode, so the raw export is never in memory at once. Each chunk
+goes through the script's prepare function (category and title mapping, cleaning, the output columns), is grouped, and the
+partial aggregates are spilled to Parquet per YEARMONTH:
+
+<spill dir>/<yyyyMM>/<chunk>.parquet
+
+The final reduce runs one YEARMONTH at a time, so peak memory is one chunk plus one month of aggregates whatever the size
+of the file. Groups are the same as grouping the whole sheet at once: NETUNITS and NETAMT are summed and 'SL Class of Trade'
+is the first non null value in sheet order, like pandas' 'first'.
+"""
+
+INGEST_CHUNK_ROWS = int(PATHS.get("INGEST_CHUNK_ROWS", 100_000))
+#None uses the system temp directory
+SPILL_DIR = PATHS.get("INGEST_SPILL_DIR")
+FIRST = 'SL Class of Trade'
+
+
+def excel_value(value, as_str: bool):
+    #the conversions pd.read_excel makes: whole floats become ints, dtype = str columns become str
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if as_str and value is not None:
+        return str(value)
+    return value
+
+
+def read_excel_chunks(path: str, sheet_name: str = 'Sheet1', chunk_rows: int = INGEST_CHUNK_ROWS, dtype: dict = None):
+    """
+    Yield the sheet as pandas DataFrames of at most chunk_rows rows, the header row gives the column names.
+    dtype is {column: str} like pd.read_excel's, other columns are inferred per chunk.
+    """
+    import openpyxl
+    wb = openpyxl.load_workbook(path, read_only = True, data_only = True)
+    try:
+        rows = wb[sheet_name].iter_rows(values_only = True)
+        header = list(next(rows))
+        as_str = [column in (dtype or {}) for column in header]
+        chunk = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            chunk.append([excel_value(value, str_column) for value, str_column in zip(row, as_str)])
+            if len(chunk) == chunk_rows:
+                yield pd.DataFrame(chunk, columns = header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns = header)
+    finally:
+        wb.close()
+
+
+def empty_stats() -> dict:
+    return {
+        'rows': 0, 'netunits': 0, 'netamt': 0.0, 'invalid_isbns': 0,
+        'netunits_neg_rows': 0, 'netunits_neg_sum': 0, 'netunits_zero_rows': 0,
+        'netamt_neg_rows': 0, 'netamt_neg_sum': 0.0, 'netamt_zero_rows': 0
+    }
+
+
+def add_stats(stats: dict, df: pd.DataFrame) -> None:
+    #the before grouping totals, summed over the chunks
+    stats['rows'] += len(df)
+    stats['netunits'] += df['NETUNITS'].sum()
+    stats['netamt'] += df['NETAMT'].sum()
+    stats['invalid_isbns'] += invalid_isbn_count(df['ISBN'])
+    stats['netunits_neg_rows'] += int((df['NETUNITS'] < 0).sum())
+    stats['netunits_neg_sum'] += df.loc[df['NETUNITS'] < 0, 'NETUNITS'].sum()
+    stats['netunits_zero_rows'] += int((df['NETUNITS'] == 0).sum())
+    stats['netamt_neg_rows'] += int((df['NETAMT'] < 0).sum())
+    stats['netamt_neg_sum'] += df.loc[df['NETAMT'] < 0, 'NETAMT'].sum()
+    stats['netamt_zero_rows'] += int((df['NETAMT'] == 0).sum())
+
+
+def partial_aggregate(df: pd.DataFrame, group_keys: list) -> pl.DataFrame:
+    partial = df.groupby(group_keys).agg({'NETUNITS': 'sum', 'NETAMT': 'sum', FIRST: 'first'}).reset_index()
+    #one schema for every chunk, so the spilled partials concatenate
+    text_keys = [key for key in group_keys if key not in ('YEAR', 'MONTH')]
+    partial[text_keys] = partial[text_keys].astype(str)
+    partial[FIRST] = partial[FIRST].astype(str).where(partial[FIRST].notna(), None)
+    return pl.from_pandas(partial).with_columns(
+        [pl.col(key).cast(pl.Utf8) for key in text_keys + [FIRST]] +
+        [pl.col(['YEAR', 'MONTH']).cast(pl.Int64), pl.col('NETUNITS').cast(pl.Int64), pl.col('NETAMT').cast(pl.Float64)]
+    )
+
+
+def spill(partial: pl.DataFrame, spill_dir: str, chunk_number: int) -> None:
+    for (year, month), month_rows in partial.partition_by(['YEAR', 'MONTH'], as_dict = True).items():
+        month_dir = os.path.join(spill_dir, str(year * 100 + month))
+        os.makedirs(month_dir, exist_ok = True)
+        month_rows.write_parquet(os.path.join(month_dir, f"{chunk_number:06d}.parquet"))
+
+
+def reduce_spills(spill_dir: str, group_keys: list) -> pl.DataFrame:
+    months = []
+    for year_month in sorted(os.listdir(spill_dir)):
+        month_dir = os.path.join(spill_dir, year_month)
+        #files in chunk order, so first() keeps the sheet order
+        partials = pl.read_parquet([os.path.join(month_dir, f) for f in sorted(os.listdir(month_dir))])
+        months.append(partials.group_by(group_keys, maintain_order = True).agg([
+            pl.col('NETUNITS').sum(),
+            pl.col('NETAMT').sum(),
+            pl.col(FIRST).drop_nulls().first()
+        ]))
+    return pl.concat(months) if months else pl.DataFrame()
+
+
+def ingest_ing_sales(path: str, prepare, group_keys: list, chunk_rows: int = INGEST_CHUNK_ROWS, sheet_name: str = 'Sheet1', dtype: dict = None) -> tuple:
+    """
+    Stream the export at path through prepare (raw chunk -> the output columns, with NETUNITS, NETAMT, ISBN, YEAR, MONTH
+    and 'SL Class of Trade') and group it by group_keys.
+    Returns (grouped polars DataFrame, before grouping stats).
+    """
+    stats = empty_stats()
+    start = datetime.datetime.now()
+    with tempfile.TemporaryDirectory(prefix = 'ing_sales_ingest_', dir = SPILL_DIR) as spill_dir:
+        for chunk_number, chunk in enumerate(read_excel_chunks(path, sheet_name, chunk_rows, dtype)):
+            prepared = prepare(chunk)
+            add_stats(stats, prepared)
+            spill(partial_aggregate(prepared, group_keys), spill_dir, chunk_number)
+            logger.info(f"Ingested chunk {chunk_number} ({stats['rows']} rows so far)")
+        grouped = reduce_spills(spill_dir, group_keys)
+    logger.info(f"Ingested {stats['rows']} rows into {len(grouped)} groups in {(datetime.datetime.now() - start).total_seconds():.1f}s")
+    return grouped, stats
@@ -0,0 +1,298 @@
+#type: ignore
+import os
+import json
+import shutil
+import hashlib
+import logging
+import datetime
+import polars as pl
+from sqlalchemy.engine import Engine
+from helpers.paths import PATHS, ING_QUERY
+from helpers.sql_reader import read_sql_polars
+from helpers.query_builder import iter_aggregated, read_aggregated
+from helpers.dtypes import apply_dtype_policy
+
+logger = logging.getLogger(__name__)
+
+"""
+Local Parquet snapshots of the Ingram sales reads, one file per YEARMONTH.
+
+ING_SALES    TUTLIV.dbo.ING_SALES as it is, read by ingram_only_pipeline (load_ing_sales)
+ING_QUERY    the rows of ING_QUERY (helpers/paths.py), ING_SALES with the Ingram names mapped to Sage names through
+             MASTER_INGRAM_NAME_MAPPING and the categories joined, read by the combined reports (load_ing_query_sales)
+
+ING_SALES only changes when monthly_sales_upload appends a month or create_ing_sales rebuilds it, so a snapshot keeps
+every month it has already pulled and a watermark (the latest YEARMONTH on disk). Each run only fetches rows newer than
+the watermark, the upload scripts call invalidate_ing_sales_snapshot so changed months are fetched again.
+The current month is never snapshotted, it is still open.
+
+ING_QUERY also depends on the lookup tables it joins (ING_QUERY_TABLES), the name mapping changes several times a month.
+The snapshot stores a fingerprint of those tables' rows, every run reads them again (a few thousand rows) and a snapshot
+whose fingerprint no longer matches is fetched again from scratch, so a month never keeps an old mapping.
+ING_QUERY is filtered to the months to fetch by wrapping it in a derived table, when SQL Server rejects that (DECLARE,
+ORDER BY) the whole query is read and the months are picked locally.
+
+Rows are summed on SQL Server to the snapshot's grain before they are fetched (helpers/query_builder.py), so a snapshot
+holds one row per grain and month with NETUNITS, NETAMT, NETAMT_INT and NETAMT_INT_ABS instead of every invoice line.
+SNAPSHOT_VERSION is stored in the manifest, a snapshot written by a different version is fetched again from scratch.
+The summed rows are fetched in batches in YEAR, MONTH order and every month is written as soon as the next one starts, so
+even the first fetch of the whole history (SALES_HISTORY_YEARS, 3 by default) holds one month and one batch at a time.
+
+Categories are not part of the ING_SALES snapshot, INGRAM_MASTER_CATEGORIES is re-uploaded every day and is joined on
+after the snapshot is read, the same way the old ING_SALES query joined it.
+
+Layout:
+<snapshot dir>/_manifest.json    {"version": SNAPSHOT_VERSION, "since": first yyyyMM fetched, "watermark": last yyyyMM on disk,
+                                  "tables": fingerprint of the lookup tables (ING_QUERY only)}
+<snapshot dir>/<yyyyMM>.parquet
+"""
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache')
+SNAPSHOT_DIR = PATHS.get("ING_SALES_SNAPSHOT", os.path.join(CACHE_DIR, 'ing_sales'))
+ING_QUERY_SNAPSHOT_DIR = PATHS.get("ING_QUERY_SNAPSHOT", os.path.join(CACHE_DIR, 'ing_query'))
+MANIFEST_FILE = '_manifest.json'
+#bump when the rows the snapshot stores change
+SNAPSHOT_VERSION = 4
+
+SNAPSHOT_QUERY = """
+    SELECT
+        TRIM(ISBN) AS ISBN,
+        TRIM(TITLE) AS TITLE,
+        TRIM(NAMECUST) AS NAMECUST,
+        YEAR,
+        MONTH,
+        TRIM([IPS Sale]) AS [IPS Sale],
+        NETUNITS,
+        NETAMT,
+        TRIM([HQ Account Number]) AS [HQ Account Number],
+        TRIM([SL Account Number]) AS [SL Account Number]
+    FROM TUTLIV.dbo.ING_SALES
+    WHERE
+        (YEAR * 100 + MONTH) > {after}
+        AND (YEAR * 100 + MONTH) < {before}
+"""
+
+HISTORY_YEARS = int(PATHS.get("SALES_HISTORY_YEARS", 3))
+
+SNAPSHOT_GRAIN = ['ISBN','TITLE','NAMECUST','YEAR','MONTH','IPS Sale','HQ Account Number','SL Account Number']
+#the ING_QUERY columns the combined reports read
+ING_QUERY_GRAIN = ['HQ_NUMBER','SL_NUMBER','ISBN','TITLE','NAMECUST','TUTTLE_SALES_CATEGORY','YEAR','MONTH']
+#lookup tables ING_QUERY joins to ING_SALES, a change to any of them refetches the ING_QUERY snapshot
+ING_QUERY_TABLES = PATHS.get("ING_QUERY_TABLES", ['MASTER_INGRAM_NAME_MAPPING', 'INGRAM_MASTER_CATEGORIES'])
+
+CATEGORY_QUERY = """
+    SELECT DISTINCT
+        TRIM([SL Account Number]) AS [SL Account Number],
+        TRIM([HQ Account Number]) AS [HQ Account Number],
+        TRIM([MASTER SALES CATEGORY]) AS TUTTLE_SALES_CATEGORY
+    FROM TUTLIV.dbo.INGRAM_MASTER_CATEGORIES
+"""
+
+
+def ing_query_months(after: int, before: int) -> str:
+    #ING_QUERY is not a format string, it is only wrapped
+    return f"SELECT * FROM (\n{ING_QUERY.strip().rstrip(';')}\n) AS ing_query\nWHERE (YEAR * 100 + MONTH) > {after} AND (YEAR * 100 + MONTH) < {before}"
+
+
+#name: how the snapshot is fetched, query(after, before) returns the rows of the months between
+SNAPSHOTS = {
+    'ING_SALES': {
+        'dir': SNAPSHOT_DIR,
+        'query': lambda after, before: SNAPSHOT_QUERY.format(after = after, before = before),
+        'grain': SNAPSHOT_GRAIN,
+        'tables': []
+    },
+    'ING_QUERY': {
+        'dir': ING_QUERY_SNAPSHOT_DIR,
+        'query': ing_query_months,
+        #read whole and filtered locally when the wrapped query is rejected
+        'base_query': ING_QUERY,
+        'grain': ING_QUERY_GRAIN,
+        'tables': ING_QUERY_TABLES
+    }
+}
+
+
+def load_manifest(snapshot_dir: str) -> dict:
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(snapshot_dir: str, manifest: dict) -> None:
+    manifest_path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def partition_files(snapshot_dir: str, start_year_month: int = 0, end_year_month: int = 999999) -> list:
+    if not os.path.isdir(snapshot_dir):
+        return []
+    year_months = sorted(int(f[:-8]) for f in os.listdir(snapshot_dir) if f.endswith('.parquet') and f[:-8].isdigit())
+    return [os.path.join(snapshot_dir, f"{ym}.parquet") for ym in year_months if start_year_month <= ym < end_year_month]
+
+
+def invalidate_snapshot(snapshot_dir: str, from_year_month: int = None) -> None:
+    if from_year_month is None:
+        shutil.rmtree(snapshot_dir, ignore_errors = True)
+        logger.info(f"Removed snapshot {snapshot_dir}")
+        return
+
+    manifest = load_manifest(snapshot_dir)
+    if not manifest:
+        return
+    for path in partition_files(snapshot_dir, from_year_month):
+        os.remove(path)
+    remaining = partition_files(snapshot_dir)
+    if not remaining or from_year_month <= manifest['since']:
+        shutil.rmtree(snapshot_dir, ignore_errors = True)
+        logger.info(f"Removed snapshot {snapshot_dir}")
+        return
+    manifest['watermark'] = min(manifest['watermark'], from_year_month - 1)
+    save_manifest(snapshot_dir, manifest)
+    logger.info(f"Invalidated snapshot {snapshot_dir} from {from_year_month}, watermark is now {manifest['watermark']}")
+
+
+def invalidate_ing_sales_snapshot(from_year_month: int = None) -> None:
+    """
+    Drop the snapshot months >= from_year_month so the next run fetches them again, or the whole snapshots when it is None.
+    Both snapshots are read from ING_SALES.
+    """
+    for snapshot in SNAPSHOTS.values():
+        invalidate_snapshot(snapshot['dir'], from_year_month)
+
+
+def table_fingerprint(engine: Engine, tables: list):
+    """
+    sha256 of the rows of tables, order independent. None when a table can not be read, the snapshot is then refetched.
+    """
+    digest = hashlib.sha256()
+    for table in tables:
+        try:
+            rows = read_sql_polars(f"SELECT * FROM TUTLIV.dbo.{table}", engine)
+        except Exception as e:
+            logger.warning(f"Could not read {table} to check the snapshot against it: {e}")
+            return None
+        rows = rows.select(pl.all().cast(pl.Utf8))
+        digest.update(f"{table}\x1f{rows.columns}\x1f".encode())
+        digest.update(rows.sort(rows.columns, nulls_last = True).write_csv().encode())
+    return digest.hexdigest()
+
+
+def write_months(snapshot_dir: str, rows: pl.DataFrame) -> list:
+    year_months = sorted(rows['YEARMONTH'].unique().to_list())
+    for ym in year_months:
+        rows.filter(pl.col('YEARMONTH') == ym).drop('YEARMONTH').write_parquet(os.path.join(snapshot_dir, f"{ym}.parquet"))
+    return year_months
+
+
+def month_batches(snapshot: dict, engine: Engine, after: int, before: int):
+    """
+    The snapshot's rows for the months after `after` and before `before`, summed to its grain, in YEAR, MONTH order.
+    """
+    batches = iter_aggregated(snapshot['query'](after, before), engine, snapshot['grain'], order_by = ['YEAR', 'MONTH'])
+    try:
+        #a rejected query fails on its first fetch
+        first = next(batches, None)
+    except Exception as e:
+        if 'base_query' not in snapshot:
+            raise
+        logger.warning(f"Could not filter the query to the months to fetch, reading all of it: {e}")
+        rows = read_aggregated(snapshot['base_query'], engine, snapshot['grain'])
+        year_month = pl.col('YEAR').cast(pl.Int64) * 100 + pl.col('MONTH').cast(pl.Int64)
+        yield rows.filter((year_month > after) & (year_month < before)).sort(['YEAR', 'MONTH'])
+        return
+
+    if first is not None:
+        yield first
+    yield from batches
+
+
+def refresh_snapshot(name: str, engine: Engine, start_year_month: int, current_year_month: int) -> None:
+    """
+    Fetch the months after the watermark and before current_year_month into the snapshot.
+    A snapshot that starts after start_year_month, or whose lookup tables changed, is rebuilt from start_year_month.
+    """
+    snapshot = SNAPSHOTS[name]
+    snapshot_dir = snapshot['dir']
+    tables = table_fingerprint(engine, snapshot['tables']) if snapshot['tables'] else None
+    manifest = load_manifest(snapshot_dir)
+    if not manifest or manifest['since'] > start_year_month or manifest.get('version') != SNAPSHOT_VERSION:
+        manifest = {}
+    elif snapshot['tables'] and (tables is None or manifest.get('tables') != tables):
+        logger.info(f"{', '.join(snapshot['tables'])} changed since the {name} snapshot was fetched, fetching it again")
+        manifest = {}
+    if not manifest:
+        shutil.rmtree(snapshot_dir, ignore_errors = True)
+        manifest = {'version': SNAPSHOT_VERSION, 'since': start_year_month, 'watermark': start_year_month - 1, 'tables': tables}
+    os.makedirs(snapshot_dir, exist_ok = True)
+
+    pending, year_months, fetched_rows = [], [], 0
+    for batch in month_batches(snapshot, engine, manifest['watermark'], current_year_month):
+        fetched_rows += len(batch)
+        if batch.is_empty():
+            continue
+        batch = batch.with_columns((pl.col('YEAR').cast(pl.Int64) * 100 + pl.col('MONTH').cast(pl.Int64)).alias('YEARMONTH'))
+        #batches come in YEARMONTH order, every month before the batch's last one is complete
+        last_year_month = batch['YEARMONTH'].max()
+        rows = pl.concat(pending + [batch], how = 'vertical_relaxed')
+        year_months += write_months(snapshot_dir, rows.filter(pl.col('YEARMONTH') < last_year_month))
+        pending = [rows.filter(pl.col('YEARMONTH') == last_year_month)]
+    if pending:
+        year_months += write_months(snapshot_dir, pl.concat(pending, how = 'vertical_relaxed'))
+
+    if year_months:
+        manifest['watermark'] = year_months[-1]
+    save_manifest(snapshot_dir, manifest)
+    logger.info(f"Fetched {fetched_rows} {name} rows for {year_months} into the snapshot, watermark is {manifest['watermark']}")
+
+
+def read_snapshot(name: str, start_year_month: int, end_year_month: int, columns: list = None) -> pl.LazyFrame:
+    #scan_parquet memory maps the files and only reads the projected columns
+    snapshot = pl.scan_parquet(partition_files(SNAPSHOTS[name]['dir'], start_year_month, end_year_month))
+    return snapshot.select(columns) if columns else snapshot
+
+
+def snapshot_window(years: int, as_of: datetime.date = None) -> tuple:
+    #(first yyyyMM read, the open yyyyMM), YEAR > current year - years excluding the current month
+    curr_dt = as_of or datetime.date.today()
+    return (curr_dt.year - years + 1) * 100 + 1, curr_dt.year * 100 + curr_dt.month
+
+
+def load_ing_sales(engine: Engine, years: int = HISTORY_YEARS, as_of: datetime.date = None) -> pl.DataFrame:
+    """
+    Ingram sales for the last `years` calendar years (YEAR > current year - years) excluding the current month,
+    with TUTTLE_SALES_CATEGORY joined from INGRAM_MASTER_CATEGORIES. Same rows and columns as the ING_SALES query of
+    ingram_only_pipeline (NAMECUST is Ingram's customer name), YEAR, MONTH, NETUNITS and NETAMT in the dtypes of the
+    ingest dtype policy (helpers/dtypes.py).
+    as_of moves the current month back for reruns of a past date, the snapshot months after it are kept but not read.
+    """
+    start_year_month, current_year_month = snapshot_window(years, as_of)
+    refresh_snapshot('ING_SALES', engine, start_year_month, current_year_month)
+
+    categories = read_sql_polars(CATEGORY_QUERY, engine)
+    ingram_sales_df = read_snapshot('ING_SALES', start_year_month, current_year_month).join(
+        categories.lazy(),
+        on = ['SL Account Number','HQ Account Number'],
+        how = 'left'
+    ).collect()
+
+    logger.info(f"Read {len(ingram_sales_df)} ING_SALES rows from the local snapshot")
+    return apply_dtype_policy(ingram_sales_df, name = 'ING_SALES')
+
+
+def load_ing_query_sales(engine: Engine, years: int = HISTORY_YEARS, as_of: datetime.date = None) -> pl.DataFrame:
+    """
+    The rows of ING_QUERY (Ingram sales with NAMECUST mapped to the Sage customer name and TUTTLE_SALES_CATEGORY) summed
+    to ING_QUERY_GRAIN, for the same months as load_ing_sales. Matches read_aggregated(ING_QUERY, engine, ING_QUERY_GRAIN)
+    as long as ING_QUERY covers those months.
+    """
+    start_year_month, current_year_month = snapshot_window(years, as_of)
+    refresh_snapshot('ING_QUERY', engine, start_year_month, current_year_month)
+
+    ingram_sales_df = read_snapshot('ING_QUERY', start_year_month, current_year_month).collect()
+    logger.info(f"Read {len(ingram_sales_df)} ING_QUERY rows from the local snapshot")
+    return apply_dtype_policy(ingram_sales_df, name = 'ING_QUERY')
@@ -0,0 +1,145 @@
+#type: ignore
+import os
+import csv
+import json
+import time
+import logging
+import datetime
+import functools
+import threading
+from contextlib import contextmanager
+from helpers.paths import PATHS
+from helpers.memory import track_peak_rss
+
+logger = logging.getLogger(__name__)
+
+"""
+Per stage timing and memory instrumentation.
+
+Wrap each stage of a pipeline (fetch, cast, aggregate, join, enrich, upload) in `with stage(report, name) as s:` and set
+s['rows_in'] / s['rows_out'] inside the block. Every stage records wall time, CPU time, rows in/out and peak RSS into the
+run's record list (shared by all threads, reports run concurrently). At the end of a run write_run_report writes the
+records as JSON and CSV, and write_metrics_table appends them to a SQL Server table. finish_run does both, every entry point
+(main.py and each database_uploads script) calls it once when it exits.
+
+CPU time is process wide (Polars computes on its own thread pool), so it includes any report running at the same time.
+"""
+
+METRICS_TABLE = 'PIPELINE_STAGE_METRICS'
+#per stage timings are always written to logs_and_tests, set WRITE_METRICS_TABLE to also append them to PIPELINE_STAGE_METRICS
+WRITE_METRICS_TABLE = bool(PATHS.get("WRITE_METRICS_TABLE", False))
+MB = 1024 * 1024
+
+RUN_ID = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+records = []
+records_lock = threading.Lock()
+
+
+def reset(run_id: str = None, suffix: str = None) -> None:
+    #suffix keeps the metrics files of scripts started in the same second apart, e.g. the two mapping uploads
+    global RUN_ID
+    RUN_ID = run_id or datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    if suffix:
+        RUN_ID = f"{RUN_ID}_{suffix}"
+    with records_lock:
+        records.clear()
+
+
+@contextmanager
+def stage(report: str, name: str, rows_in: int = None):
+    record = {
+        'run_id': RUN_ID,
+        'report': report,
+        'stage': name,
+        'started_at': datetime.datetime.now().isoformat(timespec = 'seconds'),
+        'status': 'ok',
+        'wall_s': None,
+        'cpu_s': None,
+        'rows_in': rows_in,
+        'rows_out': None,
+        'peak_rss_mb': None,
+        'rss_growth_mb': None
+    }
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        with track_peak_rss() as usage:
+            yield record
+    except Exception:
+        record['status'] = 'failed'
+        raise
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall_start, 4)
+        record['cpu_s'] = round(time.process_time() - cpu_start, 4)
+        record['peak_rss_mb'] = round(usage['peak_rss'] / MB, 1)
+        record['rss_growth_mb'] = round((usage['peak_rss'] - usage['start_rss']) / MB, 1)
+        with records_lock:
+            records.append(record)
+        logger.info(f"[{report}] {name}: {record['wall_s']:.2f}s wall, {record['cpu_s']:.2f}s cpu, rows {record['rows_in']} -> {record['rows_out']}, peak {record['peak_rss_mb']} MB ({record['status']})")
+
+
+def instrumented(report: str, name: str):
+    """
+    Decorator form of stage for a whole function, rows_out is taken from the return value when it has a length.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(report, name) as s:
+                result = func(*args, **kwargs)
+                if hasattr(result, '__len__'):
+                    s['rows_out'] = len(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def run_records() -> list:
+    with records_lock:
+        return list(records)
+
+
+def write_run_report(directory: str) -> str:
+    """
+    Write this run's stage records to <directory>/run_metrics_<run id>.json and .csv, returns the JSON path.
+    """
+    run_stages = run_records()
+    os.makedirs(directory, exist_ok = True)
+    base_path = os.path.join(directory, f"run_metrics_{RUN_ID}")
+
+    with open(base_path + '.json', 'w') as f:
+        json.dump({'run_id': RUN_ID, 'stages': run_stages}, f, indent = 2)
+
+    if run_stages:
+        with open(base_path + '.csv', 'w', newline = '') as f:
+            writer = csv.DictWriter(f, fieldnames = list(run_stages[0].keys()))
+            writer.writeheader()
+            writer.writerows(run_stages)
+
+    logger.info(f"Wrote run metrics for {len(run_stages)} stages to {base_path}.json")
+    return base_path + '.json'
+
+
+def write_metrics_table(engine, table_name: str = METRICS_TABLE, schema: str = 'dbo') -> None:
+    #appends, so the table keeps the history of every run for comparing regressions
+    import polars as pl
+    from helpers.sql_writer import write_sql
+
+    run_stages = run_records()
+    if not run_stages:
+        return
+    write_sql(pl.DataFrame(run_stages, infer_schema_length = None), table_name, engine, schema = schema, if_exists = 'append')
+
+
+def finish_run(directory: str, engine = None) -> str:
+    """
+    Write the run report, and append the records to METRICS_TABLE when WRITE_METRICS_TABLE is set and an engine is given.
+    A failed table write is logged, the run report is already on disk.
+    """
+    report_path = write_run_report(directory)
+    if WRITE_METRICS_TABLE and engine is not None:
+        try:
+            write_metrics_table(engine)
+        except Exception as e:
+            logger.error(f"Could not write stage metrics to SQL Server: {e}")
+    return report_path
@@ -0,0 +1,94 @@
+#type: ignore
+import pandas as pd
+import polars as pl
+
+"""
+Vectorized ISBN normalization and validation.
+
+normalize_isbns(frame, 'ISBN') replaces the column with the cleaned ISBN-13 string: whitespace, hyphens and spaces removed,
+float artifacts from Excel undone ('9781234567897.0', '9.781234567897E+12'), valid ISBN-10s converted to ISBN-13. Values that
+are not an ISBN (Sage item numbers, gift cards) come back cleaned but otherwise unchanged so no rows are lost.
+With valid = True it adds ISBN_VALID (13 digits with a correct check digit), with key = True ISBN_KEY (the ISBN as an Int64,
+null when it is not valid).
+
+The work is done once per distinct value (a few thousand ISBNs against millions of sales rows) and joined back, in stages so
+the cleaned value is not recomputed for every check digit. Works on DataFrames and inside LazyFrame plans.
+normalize_isbn_series and invalid_isbn_count do the same for a pandas Series in the pandas ingest scripts.
+"""
+
+ISBN13_WEIGHTS = [1, 3] * 6 + [1]
+ISBN10_WEIGHTS = list(range(10, 1, -1))
+RAW = '_ISBN_RAW'
+CLEAN = '_ISBN_CLEAN'
+
+
+def weighted_digit_sum(column: str, weights: list) -> pl.Expr:
+    return pl.sum_horizontal([pl.col(column).str.slice(i, 1).cast(pl.Int64, strict = False) * weight for i, weight in enumerate(weights)])
+
+
+def clean_isbn(column: str) -> pl.Expr:
+    value = pl.col(column).str.strip_chars().str.replace(r'^([\d-]{9,12})x$', '${1}X')
+    #Excel turns long digit strings into floats, '9.781234567897E+12' needs the float round trip, '978...897.0' only the suffix
+    scientific = value.str.contains(r'^\d(\.\d+)?E\+?\d+$')
+    value = pl.when(scientific).then(
+        value.cast(pl.Float64, strict = False).cast(pl.Int64, strict = False).cast(pl.Utf8)
+    ).otherwise(value.str.replace(r'^(\d+)\.0+$', '${1}'))
+    return value.str.replace_all(r'[-\s]', '')
+
+
+def isbn_lookup(values: pl.LazyFrame, column: str) -> pl.LazyFrame:
+    """
+    One row per distinct value of column: RAW (the original), column (normalized), ISBN_VALID and ISBN_KEY.
+    """
+    return values.select(pl.col(column).cast(pl.Utf8).alias(RAW)).unique().with_columns(
+        clean_isbn(RAW).alias(CLEAN)
+    ).with_columns(
+        #ISBN-10 check digit can be X (10), the ISBN-13 body of a valid ISBN-10 is 978 + its first 9 digits
+        pl.when(pl.col(CLEAN).str.slice(9, 1) == 'X').then(10).otherwise(pl.col(CLEAN).str.slice(9, 1).cast(pl.Int64, strict = False)).alias('_ISBN10_CHECK'),
+        weighted_digit_sum(CLEAN, ISBN10_WEIGHTS).alias('_ISBN10_SUM'),
+        (pl.lit('978') + pl.col(CLEAN).str.slice(0, 9)).alias('_ISBN13_BODY')
+    ).with_columns(
+        pl.when(
+            pl.col(CLEAN).str.contains(r'^\d{9}[\dX]$') & ((pl.col('_ISBN10_SUM') + pl.col('_ISBN10_CHECK')) % 11 == 0)
+        ).then(
+            pl.col('_ISBN13_BODY') + ((10 - weighted_digit_sum('_ISBN13_BODY', ISBN13_WEIGHTS[:12]) % 10) % 10).cast(pl.Utf8)
+        ).otherwise(pl.col(CLEAN)).alias(column)
+    ).with_columns(
+        (pl.col(column).str.contains(r'^\d{13}$') & (weighted_digit_sum(column, ISBN13_WEIGHTS) % 10 == 0)).fill_null(False).alias('ISBN_VALID')
+    ).select(
+        RAW,
+        column,
+        'ISBN_VALID',
+        pl.when(pl.col('ISBN_VALID')).then(pl.col(column).cast(pl.Int64, strict = False)).alias('ISBN_KEY')
+    )
+
+
+def normalize_isbns(frame, column: str = 'ISBN', valid: bool = False, key: bool = False):
+    """
+    frame (DataFrame or LazyFrame) with column normalized in place, plus ISBN_VALID / ISBN_KEY when asked for.
+    """
+    extra_columns = [name for name, wanted in [('ISBN_VALID', valid), ('ISBN_KEY', key)] if wanted]
+    lazy = frame.lazy() if isinstance(frame, pl.DataFrame) else frame
+    columns = lazy.collect_schema().names()
+    lookup = isbn_lookup(lazy, column).select([RAW, column] + extra_columns)
+    normalized = lazy.with_columns(pl.col(column).cast(pl.Utf8).alias(RAW)).drop(column).join(
+        lookup, on = RAW, how = 'left', nulls_equal = True, maintain_order = 'left'
+    ).select(columns + extra_columns)
+    return normalized.collect() if isinstance(frame, pl.DataFrame) else normalized
+
+
+def isbn_frame(series: pd.Series) -> pl.DataFrame:
+    #object columns from Excel mix floats and strings, Polars needs one type
+    return pl.DataFrame({'ISBN': series.astype(object).fillna('').astype(str).tolist(), 'MISSING': series.isna().to_numpy()}).select(
+        pl.when(~pl.col('MISSING')).then(pl.col('ISBN')).alias('ISBN')
+    )
+
+
+def normalize_isbn_series(series: pd.Series) -> pd.Series:
+    #missing values stay missing
+    normalized = normalize_isbns(isbn_frame(series))['ISBN']
+    return pd.Series(normalized.to_list(), index = series.index, name = series.name, dtype = object)
+
+
+def invalid_isbn_count(series: pd.Series) -> int:
+    return int((~normalize_isbns(isbn_frame(series), valid = True)['ISBN_VALID']).sum())
@@ -0,0 +1,55 @@
+#type: ignore
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+"""
+Process memory measurement.
+
+Polars and Arrow allocate outside the Python heap, so tracemalloc does not see them. These helpers read the resident set
+size of the whole process instead (psutil when installed, /proc on Linux otherwise) and track_peak_rss samples it on a
+background thread to catch the peak inside a block of code.
+"""
+
+SAMPLE_INTERVAL = 0.01
+
+
+def current_rss() -> int:
+    #resident set size of this process in bytes, 0 when it cannot be read
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+@contextmanager
+def track_peak_rss(interval: float = SAMPLE_INTERVAL):
+    """
+    with track_peak_rss() as usage: ...
+    afterwards usage holds start_rss, end_rss and peak_rss in bytes.
+    """
+    usage = {'start_rss': current_rss(), 'end_rss': 0, 'peak_rss': 0}
+    usage['peak_rss'] = usage['start_rss']
+    stop = threading.Event()
+
+    def sample():
+        while not stop.is_set():
+            usage['peak_rss'] = max(usage['peak_rss'], current_rss())
+            time.sleep(interval)
+
+    sampler = threading.Thread(target = sample, name = 'rss-sampler', daemon = True)
+    sampler.start()
+    try:
+        yield usage
+    finally:
+        stop.set()
+        sampler.join()
+        usage['end_rss'] = current_rss()
+        usage['peak_rss'] = max(usage['peak_rss'], usage['end_rss'])
@@ -0,0 +1,96 @@
+#type: ignore
+import os
+import json
+import logging
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+"""
+YEARMONTH partitioned store for per month partial aggregates.
+
+refresh_partitions fingerprints the input rows of every YEARMONTH (row count plus an order independent sum of row hashes)
+and compares them with the fingerprints stored by the last run. Only the months that are new or whose rows changed are passed
+to build, every other month is read back from its stored Parquet partition. Months that disappeared from the input are dropped.
+
+Row hashes are only stable within one Polars version, so a version change (or a missing/corrupt manifest) rebuilds everything,
+as does a change of the caller's version (bumped when build changes what it produces).
+
+Layout:
+<store_dir>/<name>/_manifest.json
+<store_dir>/<name>/<yyyyMM>.parquet
+"""
+
+MANIFEST_FILE = '_manifest.json'
+HASH_SEED = 0
+
+
+def month_fingerprints(rows: pl.DataFrame, year_month: pl.Expr) -> dict:
+    fingerprints = rows.select(
+        year_month.alias('YEARMONTH'),
+        rows.hash_rows(seed = HASH_SEED).alias('ROW_HASH')
+    ).group_by('YEARMONTH').agg([
+        pl.len().alias('ROWS'),
+        #UInt64 sum wraps on overflow, fine for a fingerprint
+        pl.col('ROW_HASH').sum().alias('HASH')
+    ])
+    return {str(ym): {'rows': n, 'hash': str(h)} for ym, n, h in fingerprints.iter_rows()}
+
+
+def load_manifest(partition_dir: str, version: int = 0) -> dict:
+    try:
+        with open(os.path.join(partition_dir, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('polars_version') != pl.__version__ or manifest.get('version', 0) != version:
+        return {}
+    return manifest.get('months', {})
+
+
+def save_manifest(partition_dir: str, months: dict, version: int = 0) -> None:
+    manifest_path = os.path.join(partition_dir, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump({'polars_version': pl.__version__, 'version': version, 'months': months}, f)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def partition_path(partition_dir: str, year_month: str) -> str:
+    return os.path.join(partition_dir, f"{year_month}.parquet")
+
+
+def refresh_partitions(name: str, rows: pl.DataFrame, year_month: pl.Expr, build, store_dir: str, version: int = 0) -> pl.DataFrame:
+    """
+    Return build(rows) for all of rows, recomputing only the YEARMONTHs whose rows changed since the last run.
+    year_month derives the yyyyMM partition of each input row, build must return a frame with an integer YEARMONTH column
+    and must only aggregate within a YEARMONTH (so building a subset of months gives those months' partitions).
+    """
+    if rows.is_empty():
+        return build(rows)
+
+    partition_dir = os.path.join(store_dir, name)
+    os.makedirs(partition_dir, exist_ok = True)
+
+    stored = load_manifest(partition_dir, version)
+    current = month_fingerprints(rows, year_month)
+
+    changed = sorted(
+        ym for ym, fingerprint in current.items()
+        if stored.get(ym) != fingerprint or not os.path.exists(partition_path(partition_dir, ym))
+    )
+    removed = sorted(ym for ym in stored if ym not in current)
+    logger.info(f"{name}: {len(current)} months, recomputing {len(changed)} {changed}, dropping {len(removed)} {removed}")
+
+    if changed:
+        changed_months = [int(ym) for ym in changed]
+        built = build(rows.filter(year_month.is_in(changed_months)))
+        for ym in changed_months:
+            built.filter(pl.col('YEARMONTH') == ym).write_parquet(partition_path(partition_dir, str(ym)))
+
+    for ym in removed:
+        if os.path.exists(partition_path(partition_dir, ym)):
+            os.remove(partition_path(partition_dir, ym))
+
+    save_manifest(partition_dir, current, version)
+
+    return pl.read_parquet([partition_path(partition_dir, ym) for ym in sorted(current)])
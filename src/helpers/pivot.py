@@ -0,0 +1,64 @@
+#type: ignore
+import datetime
+import polars as pl
+
+"""
+Conditional aggregation helpers for pivoting YEARMONTH rows into report columns.
+
+Every window column the reports produce (a single month, YTD, 12M rolling, a full year)
+is just a sum over the rows whose YEARMONTH falls inside the window. Building each one as
+a filtered sum expression lets a report compute all of its window columns in one group_by
+instead of running a filter + group_by + join + fill_null per column.
+"""
+
+
+def trailing_year_months(curr_year: int, curr_month: int, months: int = 12) -> list:
+    """
+    yyyyMM values for the full months before curr_year/curr_month, most recent first.
+    e.g. trailing_year_months(2025, 2, 3) -> [202501, 202412, 202411]
+    """
+    year_months = []
+    for i in range(1, months + 1):
+        calc_year, calc_month = divmod(curr_year * 12 + (curr_month - 1) - i, 12)
+        year_months.append(calc_year * 100 + calc_month + 1)
+    return year_months
+
+
+def year_month_label(year_month: int, fmt: str) -> str:
+    #strftime label for a yyyyMM value, e.g. '%b_%y' -> 'Aug_25'
+    return datetime.datetime(year_month // 100, year_month % 100, 1).strftime(fmt)
+
+
+def sum_where(column: str, condition: pl.Expr, alias: str) -> pl.Expr:
+    return pl.col(column).filter(condition).sum().alias(alias)
+
+
+def month_sum(column: str, year_month: int, alias: str, year_month_col: str = 'YEARMONTH') -> pl.Expr:
+    return sum_where(column, pl.col(year_month_col) == year_month, alias)
+
+
+def months_sum(column: str, year_months: list, alias: str, year_month_col: str = 'YEARMONTH') -> pl.Expr:
+    return sum_where(column, pl.col(year_month_col).is_in(year_months), alias)
+
+
+def year_sum(column: str, year: int, alias: str, year_month_col: str = 'YEARMONTH') -> pl.Expr:
+    return sum_where(column, (pl.col(year_month_col) // 100) == year, alias)
+
+
+def pivot_windows(df: pl.DataFrame, keys: list, window_expressions: list) -> pl.DataFrame:
+    """
+    Compute every window column in a single pass over df.
+    Groups with no rows in a window get 0 for that column (sum of an empty selection).
+    """
+    return df.lazy().group_by(keys).agg(window_expressions).collect()
+
+
+def null_key_rows_to(df: pl.DataFrame, keys: list, columns: list, value = 0) -> pl.DataFrame:
+    """
+    Rows whose key contains a null never matched the per column left joins the reports used before
+    pivot_windows, so their window columns always came out as `value`. Keep that behaviour.
+    """
+    any_null_key = pl.any_horizontal([pl.col(key).is_null() for key in keys])
+    return df.with_columns([
+        pl.when(any_null_key).then(value).otherwise(pl.col(col)).alias(col) for col in columns
+    ])
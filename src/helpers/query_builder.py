@@ -0,0 +1,167 @@
+#type: ignore
+import logging
+import polars as pl
+from sqlalchemy.engine import Engine
+from helpers.sql_reader import iter_sql_batches, FETCH_BATCH_ROWS, FETCH_MEMORY_CEILING
+
+logger = logging.getLogger(__name__)
+
+"""
+Server side pre-aggregation of the sales queries.
+
+The sales cube only needs sums per grain (ids, ISBN, title, customer, category, YEAR, MONTH), but ING_SALES and
+SAGE_QUERY return one row per invoice line. aggregate_query wraps a detail query in the GROUP BY for a declared grain and
+set of measures, so SQL Server sums next to the data and only one row per grain crosses the ODBC link:
+
+SELECT [ISBN], ..., [MONTH], SUM([NETUNITS]) AS [NETUNITS], SUM([NETAMT]) AS [NETAMT],
+    SUM(CAST(CAST([NETAMT] AS FLOAT) AS BIGINT)) AS [NETAMT_INT], SUM(ABS(CAST(CAST([NETAMT] AS FLOAT) AS BIGINT))) AS [NETAMT_INT_ABS]
+FROM (<detail query>) AS detail
+GROUP BY [ISBN], ..., [MONTH]
+
+SQL Server compares strings under the database collation, which is case insensitive, so a GROUP BY on TITLE would merge
+"The Book" and "THE BOOK" into one group carrying whichever spelling it returns first. The text columns in BINARY_GROUPED
+are grouped under a binary collation instead (COLLATIONS, by dialect), byte for byte like the local Polars group_by.
+
+read_aggregated runs it and falls back to reading the detail rows and grouping them locally when the server rejects the
+wrapped query (e.g. a detail query ending in ORDER BY, which SQL Server does not allow in a derived table), both paths
+return the same columns, an empty result included (empty_aggregate). iter_aggregated yields the same rows in fetch
+batches (helpers/sql_reader.iter_sql_batches), in order_by order when one is given. The local fallback folds each detail batch into running partial sums, which are
+collapsed whenever they grow past FETCH_MEMORY_CEILING, so it holds one batch plus one row per group, not the detail rows.
+
+NETAMT_INT and NETAMT_INT_ABS have to be summed from the detail rows: report_three_combined truncates every row's amount to
+whole dollars before summing (and takes abs() of it for its targets, abs() of a summed amount nets returns against sales).
+Amounts go through FLOAT before the BIGINT cast on both sides, so every type truncates toward zero (SQL Server rounds
+money and Polars rounds Decimal when they are cast to an integer directly). The report window
+columns (months, YTD, 12M) are still computed from the cube: it combines both sources and its YEARMONTH partitions are what
+lets a run re-aggregate only the months that changed.
+"""
+
+#alias: (column, summed as its absolute value, truncated to an integer per row)
+SALES_MEASURES = {
+    'NETUNITS': ('NETUNITS', False, False),
+    'NETAMT': ('NETAMT', False, False),
+    'NETAMT_INT': ('NETAMT', False, True),
+    'NETAMT_INT_ABS': ('NETAMT', True, True)
+}
+
+#dtypes of an empty aggregate, grain columns not listed are text and measures not listed Float64
+EMPTY_DTYPES = {'YEAR': pl.Int64, 'MONTH': pl.Int64, 'NETUNITS': pl.Int64}
+
+#text grain columns, grouped byte for byte so case variants stay separate groups like they do in Polars
+BINARY_GROUPED = ['ISBN', 'TITLE', 'NAMECUST', 'TUTTLE_SALES_CATEGORY', 'IPS Sale']
+#binary collation by dialect, other dialects group under their default collation
+COLLATIONS = {
+    'mssql': 'Latin1_General_100_BIN2',
+    'sqlite': 'BINARY'
+}
+
+
+def quote(column: str) -> str:
+    #the detail queries alias columns like [IPS Sale]
+    return f"[{column}]"
+
+
+def measure_sql(column: str, absolute: bool, truncate: bool = False) -> str:
+    value = f"CAST(CAST({quote(column)} AS FLOAT) AS BIGINT)" if truncate else quote(column)
+    return f"SUM(ABS({value}))" if absolute else f"SUM({value})"
+
+
+def truncated(column: str) -> pl.Expr:
+    #toward zero, through Float64 like measure_sql
+    return pl.col(column).cast(pl.Float64).cast(pl.Int64)
+
+
+def measure_expr(column: str, absolute: bool, truncate: bool = False) -> pl.Expr:
+    value = truncated(column) if truncate else pl.col(column)
+    return value.abs().sum() if absolute else value.sum()
+
+
+def grain_sql(column: str, collation: str = None) -> str:
+    if collation and column in BINARY_GROUPED:
+        return f"{quote(column)} COLLATE {collation}"
+    return quote(column)
+
+
+def aggregate_query(detail_query: str, grain: list, measures: dict = SALES_MEASURES, order_by: list = None, collation: str = None) -> str:
+    """
+    detail_query grouped by grain, one column per measure, sorted by order_by (grain columns) when given.
+    The BINARY_GROUPED columns are grouped under collation when one is given.
+    """
+    group_sql = ', '.join(grain_sql(col, collation) for col in grain)
+    #the select list has to repeat the collated expressions of the GROUP BY
+    select_sql = ', '.join(f"{grain_sql(col, collation)} AS {quote(col)}" for col in grain)
+    measures_sql = ', '.join(f"{measure_sql(*measure)} AS {quote(alias)}" for alias, measure in measures.items())
+    query = f"SELECT {select_sql}, {measures_sql}\nFROM (\n{detail_query.strip().rstrip(';')}\n) AS detail\nGROUP BY {group_sql}"
+    if order_by:
+        query += f"\nORDER BY {', '.join(quote(col) for col in order_by)}"
+    return query
+
+
+def empty_aggregate(grain: list, measures: dict = SALES_MEASURES) -> pl.DataFrame:
+    #an empty result set comes back from arrow-odbc as no batches at all, the readers still need the columns
+    return pl.DataFrame(schema = {col: EMPTY_DTYPES.get(col, pl.Utf8) for col in grain} | {
+        alias: pl.Int64 if truncate else EMPTY_DTYPES.get(column, pl.Float64) for alias, (column, absolute, truncate) in measures.items()
+    })
+
+
+def aggregate_locally(detail_df: pl.DataFrame, grain: list, measures: dict = SALES_MEASURES) -> pl.DataFrame:
+    return detail_df.group_by(grain).agg([measure_expr(*measure).alias(alias) for alias, measure in measures.items()])
+
+
+def collapse(partials: list, grain: list, measures: dict = SALES_MEASURES) -> pl.DataFrame:
+    #partial sums add up, the absolute and truncated measures were already taken per detail row
+    return pl.concat(partials, how = 'vertical_relaxed').group_by(grain).agg([pl.col(alias).sum() for alias in measures])
+
+
+def fold_batches(batches, grain: list, measures: dict = SALES_MEASURES, memory_ceiling: int = FETCH_MEMORY_CEILING) -> pl.DataFrame:
+    """
+    Sum detail batches by grain, keeping one batch plus the running partial sums in memory.
+    """
+    partials, partial_size, rows = [], 0, 0
+    threshold = memory_ceiling
+    for batch in batches:
+        rows += len(batch)
+        partials.append(aggregate_locally(batch, grain, measures))
+        partial_size += partials[-1].estimated_size()
+        if partial_size > threshold and len(partials) > 1:
+            partials = [collapse(partials, grain, measures)]
+            partial_size = partials[0].estimated_size()
+            if partial_size > memory_ceiling and threshold == memory_ceiling:
+                logger.warning(f"{len(partials[0])} groups alone take {partial_size / 1024 / 1024:.0f} MB, above the fetch memory ceiling")
+            #more groups than the ceiling holds, collapse again only once the partials have doubled
+            threshold = max(memory_ceiling, 2 * partial_size)
+    if not partials:
+        return empty_aggregate(grain, measures)
+    aggregated = collapse(partials, grain, measures)
+    logger.info(f"Aggregated {rows} detail rows into {len(aggregated)} locally")
+    return aggregated
+
+
+def iter_aggregated(detail_query: str, engine: Engine, grain: list, measures: dict = SALES_MEASURES, order_by: list = None, batch_size: int = FETCH_BATCH_ROWS):
+    """
+    The rows of detail_query summed by grain in fetch batches, aggregated on the server when it accepts the wrapped query.
+    """
+    collation = COLLATIONS.get(engine.dialect.name)
+    batches = iter_sql_batches(aggregate_query(detail_query, grain, measures, order_by, collation), engine, batch_size)
+    try:
+        #a rejected query fails on its first fetch
+        first = next(batches, None)
+    except Exception as e:
+        logger.warning(f"Server side aggregation failed, aggregating the detail rows locally: {e}")
+        aggregated = fold_batches(iter_sql_batches(detail_query, engine, batch_size), grain, measures)
+        yield aggregated.sort(order_by) if order_by else aggregated
+        return
+
+    if first is not None:
+        yield first
+    yield from batches
+
+
+def read_aggregated(detail_query: str, engine: Engine, grain: list, measures: dict = SALES_MEASURES) -> pl.DataFrame:
+    """
+    The rows of detail_query summed by grain, aggregated on the server when it accepts the wrapped query.
+    """
+    batches = list(iter_aggregated(detail_query, engine, grain, measures))
+    aggregated = pl.concat(batches, how = 'vertical_relaxed') if batches else empty_aggregate(grain, measures)
+    logger.info(f"Read {len(aggregated)} aggregated rows")
+    return aggregated
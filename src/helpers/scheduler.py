@@ -0,0 +1,73 @@
+#type: ignore
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+"""
+Run independent reports concurrently.
+
+The reports only read the shared sales cube and spend most of their time waiting on SQL Server (lookups and uploads),
+Polars releases the GIL while it computes, so a thread pool overlaps them without copying the inputs into other processes.
+A report that raises is logged and recorded as failed, the others keep running.
+"""
+
+DEFAULT_WORKERS = 2
+
+
+def timed_run(name: str, report) -> dict:
+    start = time.perf_counter()
+    logger.info(f"Starting {name}")
+    try:
+        result = report()
+    except Exception as e:
+        logger.exception(f"{name} failed: {e}")
+        return {'status': 'failed', 'seconds': time.perf_counter() - start, 'result': None, 'error': repr(e)}
+    seconds = time.perf_counter() - start
+    logger.info(f"Finished {name} in {seconds:.1f}s")
+    return {'status': 'ok', 'seconds': seconds, 'result': result, 'error': None}
+
+
+def run_reports(reports: dict, max_workers: int = DEFAULT_WORKERS) -> dict:
+    """
+    reports maps a report name to a zero argument callable (use functools.partial or a lambda to bind its inputs).
+    Returns {name: {'status': 'ok' | 'failed', 'seconds': float, 'result': ..., 'error': str}} in the order given.
+    """
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'report') as pool:
+        futures = {name: pool.submit(timed_run, name, report) for name, report in reports.items()}
+        summary = {name: future.result() for name, future in futures.items()}
+
+    logger.info(f"Ran {len(reports)} reports on {max_workers} workers in {time.perf_counter() - start:.1f}s")
+    for name, outcome in summary.items():
+        logger.info(f"  {name:<30} {outcome['status']:<7} {outcome['seconds']:.1f}s")
+    return summary
+
+
+def failed_reports(summary: dict) -> list:
+    return [name for name, outcome in summary.items() if outcome['status'] != 'ok']
+
+
+def timed_fetch(name: str, fetch) -> tuple:
+    start = time.perf_counter()
+    result = fetch()
+    return result, time.perf_counter() - start
+
+
+def prefetch(sources: dict, max_workers: int = None) -> dict:
+    """
+    Run every independent source read in sources (name -> zero argument callable) at once and return {name: result}.
+    The fetch phase then takes as long as the slowest read instead of the sum of all of them.
+    Unlike run_reports a failed read is raised, the reports cannot run without their inputs.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = max_workers or len(sources), thread_name_prefix = 'prefetch') as pool:
+        futures = {name: pool.submit(timed_fetch, name, fetch) for name, fetch in sources.items()}
+        results = {}
+        for name, future in futures.items():
+            results[name], seconds = future.result()
+            logger.info(f"Prefetched {name} in {seconds:.1f}s")
+    logger.info(f"Prefetched {len(sources)} sources in {time.perf_counter() - start:.1f}s")
+    return results
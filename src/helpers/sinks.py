@@ -0,0 +1,78 @@
+#type: ignore
+import os
+import logging
+import functools
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from helpers.sql_writer import publish_sql, to_polars
+from helpers.categorical import decode_categoricals
+
+logger = logging.getLogger(__name__)
+
+"""
+Where the reports write their tables.
+
+A sink is called like publish_sql without the engine, sink(df, table_name, schema = 'dbo', indexes = None), and returns
+the number of rows written. Every report takes one (sink = None publishes to SQL Server through its tutliv_engine):
+
+sqlserver    publish_sql on the TUTLIV engine, the production tables
+parquet      <directory>/<table_name>.parquet, replaced atomically, for dry runs and diffing a rerun against production
+sqlite       <directory>/dbo.db through publish_sql, a local database with the same dbo.<table> names
+
+Only the report tables go to the sink. The lookups the reports read (ARCUS, BOOK_DETAILS, ...) still come from TUTLIV.
+"""
+
+SINKS = ['sqlserver', 'parquet', 'sqlite']
+
+
+def sqlite_engine(directory: str) -> Engine:
+    """
+    SQLite engine on <directory>/tutliv.db with <directory>/dbo.db attached as 'dbo' on every connection, so schema='dbo'
+    writes and dbo.<table> reads work like they do on SQL Server.
+    """
+    os.makedirs(directory, exist_ok = True)
+    engine = sqlalchemy.create_engine(f"sqlite:///{os.path.join(directory, 'tutliv.db')}")
+    dbo_path = os.path.join(directory, 'dbo.db').replace("'", "''")
+
+    @event.listens_for(engine, 'connect')
+    def attach_dbo(dbapi_connection, connection_record):
+        dbapi_connection.execute(f"ATTACH DATABASE '{dbo_path}' AS dbo")
+
+    return engine
+
+
+def sql_server_sink(engine: Engine):
+    return functools.partial(publish_sql, engine = engine)
+
+
+def parquet_sink(directory: str):
+    os.makedirs(directory, exist_ok = True)
+
+    def publish_parquet(df, table_name: str, schema: str = 'dbo', indexes: list = None, **kwargs) -> int:
+        df = decode_categoricals(to_polars(df))
+        path = os.path.join(directory, f"{table_name}.parquet")
+        #readers never see a half written file
+        df.write_parquet(path + '.tmp')
+        os.replace(path + '.tmp', path)
+        logger.info(f"Wrote {len(df)} rows to {path}")
+        return len(df)
+
+    return publish_parquet
+
+
+def sqlite_sink(directory: str):
+    return sql_server_sink(sqlite_engine(directory))
+
+
+def make_sink(kind: str, engine: Engine = None, directory: str = None):
+    """
+    The sink named kind (one of SINKS), engine is used by 'sqlserver' and directory by 'parquet' and 'sqlite'.
+    """
+    if kind == 'sqlserver':
+        return sql_server_sink(engine)
+    if kind == 'parquet':
+        return parquet_sink(directory)
+    if kind == 'sqlite':
+        return sqlite_sink(directory)
+    raise ValueError(f"unknown sink {kind!r}, expected one of {SINKS}")
@@ -0,0 +1,93 @@
+#type: ignore
+import logging
+import pandas as pd
+import polars as pl
+from sqlalchemy.engine import Engine
+from helpers.paths import PATHS
+
+logger = logging.getLogger(__name__)
+
+"""
+Read SQL Server result sets into Polars.
+
+The fast path uses arrow-odbc, which fetches the result set from the ODBC driver straight into Arrow
+record batches (no python row tuples and no pandas copy), Polars then wraps those batches without copying.
+If arrow-odbc is not installed, the engine is not an mssql+pyodbc engine, or the read fails for any reason,
+the result set is read through pandas in FETCH_BATCH_ROWS chunks, each chunk is converted to Polars and dropped
+before the next one is fetched, so the rows are never held as row tuples, pandas and Polars at once.
+
+iter_sql_batches yields those batches one at a time for callers that fold them into running aggregates or write them
+out as they arrive (helpers/query_builder.py, helpers/ing_sales_snapshot.py), FETCH_MEMORY_CEILING_MB bounds what those
+callers keep in memory between batches.
+"""
+
+ARROW_BATCH_SIZE = 100_000
+FETCH_BATCH_ROWS = int(PATHS.get("FETCH_BATCH_ROWS", ARROW_BATCH_SIZE))
+FETCH_MEMORY_CEILING = int(PATHS.get("FETCH_MEMORY_CEILING_MB", 512)) * 1024 * 1024
+
+
+def odbc_connection_string(engine: Engine):
+    #engines are created with mssql+pyodbc:///?odbc_connect=<quoted SSMS_CONN_STRING>
+    if engine is None or engine.url.get_backend_name() != 'mssql':
+        return None
+    return engine.url.query.get('odbc_connect')
+
+
+def arrow_reader(query: str, connection_string: str, batch_size: int = ARROW_BATCH_SIZE):
+    from arrow_odbc import read_arrow_batches_from_odbc
+
+    reader = read_arrow_batches_from_odbc(query = query, connection_string = connection_string, batch_size = batch_size)
+    if reader is None:
+        raise ValueError('query did not return a result set')
+    return reader
+
+
+def read_arrow(query: str, connection_string: str, batch_size: int = ARROW_BATCH_SIZE) -> pl.DataFrame:
+    import pyarrow as pa
+
+    reader = arrow_reader(query, connection_string, batch_size)
+    table = pa.Table.from_batches(list(reader), schema = reader.schema)
+    return pl.from_arrow(table)
+
+
+def iter_pandas_batches(query: str, engine: Engine, batch_size: int = FETCH_BATCH_ROWS):
+    #fetchmany under the hood, an empty result still yields one empty frame with the columns
+    with engine.connect().execution_options(stream_results = True) as connection:
+        for chunk in pd.read_sql(query, connection, chunksize = batch_size):
+            yield pl.from_pandas(chunk)
+
+
+def iter_sql_batches(query: str, engine: Engine, batch_size: int = FETCH_BATCH_ROWS):
+    """
+    The result set of query as Polars frames of at most batch_size rows. Batches read through pandas can type a column
+    differently (a chunk of only nulls), combine them with pl.concat(how = 'vertical_relaxed').
+    """
+    connection_string = odbc_connection_string(engine)
+    if connection_string is not None:
+        try:
+            reader = arrow_reader(query, connection_string, batch_size)
+        except ImportError:
+            logger.debug('arrow-odbc not installed, reading through pandas')
+        except Exception as e:
+            logger.warning(f"arrow-odbc read failed, falling back to pandas: {e}")
+        else:
+            for batch in reader:
+                yield pl.from_arrow(batch)
+            return
+
+    yield from iter_pandas_batches(query, engine, batch_size)
+
+
+def read_sql_polars(query: str, engine: Engine, batch_size: int = ARROW_BATCH_SIZE) -> pl.DataFrame:
+    connection_string = odbc_connection_string(engine)
+    if connection_string is not None:
+        try:
+            df = read_arrow(query, connection_string, batch_size)
+            logger.debug(f"arrow-odbc read {len(df)} rows")
+            return df
+        except ImportError:
+            logger.debug('arrow-odbc not installed, reading through pandas')
+        except Exception as e:
+            logger.warning(f"arrow-odbc read failed, falling back to pandas: {e}")
+
+    return pl.concat(iter_pandas_batches(query, engine, FETCH_BATCH_ROWS), how = 'vertical_relaxed')
@@ -0,0 +1,175 @@
+#type: ignore
+import time
+import logging
+import pandas as pd
+import polars as pl
+import sqlalchemy
+from sqlalchemy.engine import Engine
+from helpers.categorical import decode_categoricals
+
+logger = logging.getLogger(__name__)
+
+"""
+Write report frames to SQL Server in large batches.
+
+DataFrame.to_sql on an mssql+pyodbc engine sends one INSERT round trip per row and types every string
+column as VARCHAR(max). write_sql creates the table from explicit column types (derived from the Polars schema
+unless dtype overrides them), then inserts the rows in batch_size chunks through a pyodbc cursor with
+fast_executemany, which binds a whole chunk as parameter arrays in a single round trip.
+Engines that are not mssql+pyodbc (e.g. a local SQLite file) go through pandas to_sql with the same
+column types and chunksize.
+"""
+
+WRITE_BATCH_SIZE = 50_000
+
+#VARCHAR(n) can only go up to 8000, longer string columns stay VARCHAR(max)
+MAX_VARCHAR_LENGTH = 8000
+
+
+def sql_types(df: pl.DataFrame, dtype: dict = None) -> dict:
+    """
+    SQLAlchemy column types for every column of df, strings are sized to their longest value.
+    Anything in dtype overrides the derived type for that column.
+    """
+    types = {}
+    for col, col_type in df.schema.items():
+        if col_type in (pl.Utf8, pl.Categorical) or isinstance(col_type, pl.Enum):
+            max_length = df[col].cast(pl.Utf8).str.len_chars().max() or 1
+            types[col] = sqlalchemy.types.String(max_length) if max_length <= MAX_VARCHAR_LENGTH else sqlalchemy.types.Text()
+        elif col_type in (pl.Int8, pl.Int16, pl.Int32, pl.UInt8, pl.UInt16):
+            types[col] = sqlalchemy.types.Integer()
+        elif col_type.is_integer():
+            types[col] = sqlalchemy.types.BigInteger()
+        elif col_type.is_float():
+            types[col] = sqlalchemy.types.Float(precision = 53)
+        elif isinstance(col_type, pl.Decimal):
+            types[col] = sqlalchemy.types.Numeric(col_type.precision or 38, col_type.scale or 0)
+        elif col_type == pl.Boolean:
+            types[col] = sqlalchemy.types.Boolean()
+        elif col_type == pl.Date:
+            types[col] = sqlalchemy.types.Date()
+        elif isinstance(col_type, pl.Datetime):
+            types[col] = sqlalchemy.types.DateTime()
+        else:
+            types[col] = sqlalchemy.types.Text()
+    types.update(dtype or {})
+    return types
+
+
+def to_polars(df) -> pl.DataFrame:
+    if isinstance(df, pl.DataFrame):
+        return df
+    if isinstance(df, pd.DataFrame):
+        return pl.from_pandas(df)
+    return pl.from_arrow(df)
+
+
+def insert_batches(connection, df: pl.DataFrame, table_name: str, schema: str, batch_size: int) -> None:
+    columns = ', '.join(f'[{col}]' for col in df.columns)
+    placeholders = ', '.join('?' for _ in df.columns)
+    insert_sql = f"INSERT INTO [{schema}].[{table_name}] ({columns}) VALUES ({placeholders})"
+
+    #NaN is not a valid SQL Server float, to_sql wrote it as NULL
+    df = df.with_columns(pl.col(pl.Float32, pl.Float64).fill_nan(None))
+
+    cursor = connection.connection.cursor()
+    cursor.fast_executemany = True
+    try:
+        for offset in range(0, len(df), batch_size):
+            cursor.executemany(insert_sql, df.slice(offset, batch_size).rows())
+    finally:
+        cursor.close()
+
+
+def write_sql(df, table_name: str, engine: Engine, schema: str = 'dbo', if_exists: str = 'replace', batch_size: int = WRITE_BATCH_SIZE, dtype: dict = None) -> int:
+    """
+    Write a Polars, pandas or Arrow frame to schema.table_name, returns the number of rows written.
+    if_exists behaves like DataFrame.to_sql ('replace', 'append' or 'fail'). The table is created and filled in
+    one transaction, so a failed insert leaves the previous table in place.
+    """
+    #Categorical/Enum columns go to SQL Server as plain strings
+    df = decode_categoricals(to_polars(df))
+    types = sql_types(df, dtype)
+    start = time.perf_counter()
+
+    with engine.begin() as connection:
+        #creates (or replaces) the empty table with the explicit column types, no rows are sent here
+        df.head(0).to_pandas().to_sql(table_name, connection, schema = schema, if_exists = if_exists, index = False, dtype = types)
+
+        if engine.dialect.name == 'mssql' and engine.dialect.driver == 'pyodbc':
+            insert_batches(connection, df, table_name, schema, batch_size)
+        else:
+            df.to_pandas().to_sql(table_name, connection, schema = schema, if_exists = 'append', index = False, dtype = types, chunksize = batch_size)
+
+    elapsed = time.perf_counter() - start
+    rows_per_sec = len(df) / elapsed if elapsed > 0 else float(len(df))
+    logger.info(f"Wrote {len(df)} rows to {schema}.{table_name} in {elapsed:.1f}s ({rows_per_sec:,.0f} rows/sec)")
+    return len(df)
+
+
+"""
+Publishing a table without taking it away from readers.
+
+write_sql(if_exists='replace') drops the live table before the new rows are in, so anything querying it during the run
+sees a missing or locked table. publish_sql loads and indexes a staging copy at full speed while the live table keeps
+serving reads, then swaps the two names in one short transaction. Only the rename holds a schema lock.
+"""
+
+STAGING_SUFFIX = '_STAGING'
+RETIRED_SUFFIX = '_RETIRED'
+
+
+def index_name(table_name: str, columns: list) -> str:
+    return f"IX_{table_name}_{'_'.join(columns)}"
+
+
+def create_indexes(engine: Engine, table_name: str, staging_table: str, schema: str, indexes: list) -> None:
+    #indexes are named after the published table, they keep their name through the rename
+    with engine.begin() as connection:
+        for columns in indexes:
+            column_list = ', '.join(f'[{col}]' for col in columns)
+            connection.execute(sqlalchemy.text(
+                f"CREATE INDEX [{index_name(table_name, columns)}] ON [{schema}].[{staging_table}] ({column_list})"
+            ))
+
+
+def rename_table(connection, schema: str, old_name: str, new_name: str) -> None:
+    if connection.dialect.name == 'mssql':
+        connection.execute(sqlalchemy.text(f"EXEC sp_rename '{schema}.{old_name}', '{new_name}'"))
+    else:
+        connection.execute(sqlalchemy.text(f"ALTER TABLE [{schema}].[{old_name}] RENAME TO [{new_name}]"))
+
+
+def drop_table(engine: Engine, table_name: str, schema: str) -> None:
+    with engine.begin() as connection:
+        if sqlalchemy.inspect(connection).has_table(table_name, schema = schema):
+            connection.execute(sqlalchemy.text(f"DROP TABLE [{schema}].[{table_name}]"))
+
+
+def swap_tables(engine: Engine, staging_table: str, table_name: str, schema: str) -> None:
+    retired_table = f"{table_name}{RETIRED_SUFFIX}"
+    #left behind if a previous run failed between the swap and the drop
+    drop_table(engine, retired_table, schema)
+
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        if sqlalchemy.inspect(connection).has_table(table_name, schema = schema):
+            rename_table(connection, schema, table_name, retired_table)
+        rename_table(connection, schema, staging_table, table_name)
+    logger.info(f"Swapped {schema}.{staging_table} in as {schema}.{table_name} in {time.perf_counter() - start:.2f}s")
+
+    drop_table(engine, retired_table, schema)
+
+
+def publish_sql(df, table_name: str, engine: Engine, schema: str = 'dbo', batch_size: int = WRITE_BATCH_SIZE, dtype: dict = None, indexes: list = None) -> int:
+    """
+    Load df into schema.<table_name>_STAGING, build indexes (a list of column lists) on it, then swap it in as
+    schema.table_name. Returns the number of rows written. If the load fails the live table is untouched.
+    """
+    staging_table = f"{table_name}{STAGING_SUFFIX}"
+    rows_written = write_sql(df, staging_table, engine, schema = schema, if_exists = 'replace', batch_size = batch_size, dtype = dtype)
+    #index names are per table in SQL Server but database wide in e.g. SQLite, where the live table still holds them
+    if indexes and engine.dialect.name == 'mssql':
+        create_indexes(engine, table_name, staging_table, schema, indexes)
+    swap_tables(engine, staging_table, table_name, schema)
+    return rows_written
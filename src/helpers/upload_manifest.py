@@ -0,0 +1,138 @@
+#type: ignore
+import os
+import json
+import hashlib
+import logging
+import pandas as pd
+import sqlalchemy
+from helpers.paths import PATHS
+
+logger = logging.getLogger(__name__)
+
+"""
+Change detection for the mapping uploads.
+
+Every source workbook has its own manifest that remembers the workbook's mtime, size and sha256 plus a hash of every sheet
+that was read from it, and for every table uploaded from it the row count and a row hash of the uploaded frame. An upload
+is skipped when:
+
+source_unchanged    the workbook has the same mtime and size as last time (cheap pre-check, the file is not opened), or
+                    failing that the same sha256 (saved again without edits), and every table it feeds still has the row
+                    count that was uploaded (so a table dropped or rewritten on the server is uploaded again)
+table_unchanged     the workbook did change but the frame read for this table hashes the same as the last upload
+
+One manifest per workbook lets the uploads run side by side (the Airflow DAG runs upload_name_mapping and
+upload_sales_category in parallel), each upload only reads and writes the manifest of its own workbook.
+
+Row hashes are pandas' hash_pandas_object, which only stays stable within one pandas version, a version change
+(or a missing/corrupt manifest) uploads everything again.
+
+Layout:
+<UPLOAD_MANIFEST_DIR>/<workbook name>_<path hash>.json    {"pandas_version": ..., "source": path, "mtime", "size", "sha256", "sheets": {sheet: hash}, "tables": {table: {rows, hash}}}
+"""
+
+MANIFEST_DIR = PATHS.get("UPLOAD_MANIFEST_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'uploads'))
+HASH_CHUNK = 1024 * 1024
+
+
+def manifest_path(path: str) -> str:
+    #the path hash keeps two workbooks with the same file name apart
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(MANIFEST_DIR, f"{name}_{hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]}.json")
+
+
+def load_manifest(path: str) -> dict:
+    try:
+        with open(manifest_path(path)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    if manifest.get('pandas_version') != pd.__version__ or manifest.get('source') != path:
+        manifest = {'pandas_version': pd.__version__, 'source': path, 'sheets': {}, 'tables': {}}
+    return manifest
+
+
+def save_manifest(path: str, manifest: dict) -> None:
+    target = manifest_path(path)
+    os.makedirs(MANIFEST_DIR, exist_ok = True)
+    with open(target + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent = 2)
+    os.replace(target + '.tmp', target)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def frame_hash(df: pd.DataFrame) -> str:
+    #order dependent: a reordered sheet is uploaded again, the table rows come out in sheet order
+    digest = hashlib.sha256('\x1f'.join(map(str, df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index = False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def table_rows(engine, table: str, schema: str = 'dbo'):
+    try:
+        with engine.connect() as connection:
+            return connection.execute(sqlalchemy.text(f"SELECT COUNT(*) FROM {schema}.{table}")).scalar()
+    except Exception as e:
+        logger.info(f"Could not count rows of {schema}.{table}: {e}")
+        return None
+
+
+def source_unchanged(path: str, tables: list, engine, schema: str = 'dbo') -> bool:
+    """
+    True when path has not changed since its tables were last uploaded from it and those tables are still on the server.
+    """
+    manifest = load_manifest(path)
+    if 'sha256' not in manifest:
+        logger.info(f"{path}: no previous upload recorded")
+        return False
+
+    stat = os.stat(path)
+    if (manifest['mtime'], manifest['size']) != (stat.st_mtime, stat.st_size):
+        if file_sha256(path) != manifest['sha256']:
+            logger.info(f"{path}: contents changed since the last upload")
+            return False
+        #saved again without edits, remember the new mtime so the next run skips hashing
+        manifest['mtime'], manifest['size'] = stat.st_mtime, stat.st_size
+        save_manifest(path, manifest)
+
+    for table in tables:
+        uploaded = manifest['tables'].get(table)
+        if uploaded is None:
+            logger.info(f"{path}: no previous upload of {table} recorded")
+            return False
+        server_rows = table_rows(engine, table, schema)
+        if server_rows != uploaded['rows']:
+            logger.info(f"{path}: {schema}.{table} has {server_rows} rows, {uploaded['rows']} were uploaded")
+            return False
+
+    logger.info(f"{path}: unchanged since the last upload of {', '.join(tables)}, skipping")
+    return True
+
+
+def table_unchanged(path: str, table: str, df: pd.DataFrame) -> bool:
+    uploaded = load_manifest(path)['tables'].get(table)
+    unchanged = uploaded is not None and uploaded['rows'] == len(df) and uploaded['hash'] == frame_hash(df)
+    if unchanged:
+        logger.info(f"{table}: rows read are identical to the last upload, skipping")
+    return unchanged
+
+
+def record_upload(path: str, sheet: str, table: str, df: pd.DataFrame) -> None:
+    """
+    Record that table was uploaded from sheet of path with the rows in df.
+    """
+    manifest = load_manifest(path)
+    stat = os.stat(path)
+    if (manifest.get('mtime'), manifest.get('size')) != (stat.st_mtime, stat.st_size):
+        manifest.update({'mtime': stat.st_mtime, 'size': stat.st_size, 'sha256': file_sha256(path)})
+    row_hash = frame_hash(df)
+    manifest['sheets'][sheet] = row_hash
+    manifest['tables'][table] = {'rows': len(df), 'hash': row_hash}
+    save_manifest(path, manifest)
@@ -1,89 +1,253 @@
 #type: ignore
-import pandas as pd
-import numpy as np
-from dbfread import DBF
-import sqlalchemy
-from sqlalchemy.engine import Engine
-import xlwings as xw
-import urllib
-from helpers.paths import PATHS
-from helpers.paths import ING_QUERY, SAGE_QUERY
-from pipelines.combined_sales_report import combined_sales_report
-from pipelines.report_three_combined import report_three_combined
-from pipelines.book_level_reports import revenue_report
-import datetime
-import json
-from rapidfuzz import process, fuzz
+import os
 import sys
 import time
-import sqlite3
-import polars as pl
 import logging
-import os
+import argparse
+import datetime
+import pandas as pd
+import polars as pl
+from helpers.paths import PATHS, SAGE_QUERY
+from helpers.engine import get_engine, dispose_engine
+from helpers.dtypes import apply_dtype_policy
+from helpers.query_builder import read_aggregated
+from helpers.ing_sales_snapshot import load_ing_sales, load_ing_query_sales
+from helpers.scheduler import run_reports, failed_reports, prefetch
+from helpers import instrumentation
+from helpers.instrumentation import stage, finish_run
+from helpers.sinks import SINKS, make_sink
+from helpers.handoff import write_inputs, read_inputs
+from pipelines.sales_cube import build_sales_cube, closed_months, SAGE_GRAIN
+from pipelines.combined_sales_report import combined_sales_report, fetch_all_accounts, fetch_book_details
+from pipelines.report_three_combined import report_three_combined, fetch_customer_city_state
+from pipelines import ingram_only_pipeline
+from pipelines.book_level_reports import run_all_book_reports
+from database_uploads.upload_master_name_mapping import main as name_mapping_upload
+from database_uploads.upload_master_sales_category import main as category_mapping_upload
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("logs_and_tests/reporting_pipeline.log", mode='w'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
 logger = logging.getLogger(__name__)
 
-SSMS_CONN_STRING = PATHS["SSMS_CONN_STRING"]
-INGRAM_SALES_DBF = PATHS["INGRAM_SALES_DBF"]
-INGRAM_CUSTCODES = PATHS["ACCT_CODES_DESCR_INGRAM"]
-ISBN_WEBCAT = PATHS["ISBN_WEBCAT"]
-SAGE_CUST_CODES = PATHS["SAGE_CUST_CODES"]
-JSON_CUST_CODES = PATHS["JSON_CUST_CODES"]
-EXPORT_XL = PATHS["ALL_SALES_INCL_ING"] 
-DB_PATH = PATHS["DB_PATH"]
 TARGET_CALCULATIONS_FILE = PATHS["TARGET_CALCULATION_FILE"]
+#per YEARMONTH cube partitions kept between runs, only months whose source rows changed are re-aggregated
+SALES_CUBE_PARTITIONS = PATHS.get("SALES_CUBE_PARTITIONS", "cache/sales_cube")
+REPORT_WORKERS = int(PATHS.get("REPORT_WORKERS", 2))
+#where the parquet and sqlite sinks write when --output is not given
+DRY_RUN_DIR = PATHS.get("DRY_RUN_DIR", "dry_run")
+LOG_FILE = "logs_and_tests/reporting_pipeline.log"
 
+"""
+Command line entry point for the reports.
 
-if __name__ == "__main__":
-    params = urllib.parse.quote_plus(SSMS_CONN_STRING)
-    engine = sqlalchemy.create_engine(f"mssql+pyodbc:///?odbc_connect={params}",connect_args={'timeout':1800,'connect_timeout':120},pool_recycle=3600)
-    """
-    Begin by getting all INGRAM Sales data for the last 3 years not including the current month
+    cd src
+    python main.py                                                    the daily reports, published to SQL Server
+    python main.py --reports ingram_only_pipeline --sink parquet      one report, written to dry_run/<TABLE>.parquet
+    python main.py --as-of 2025-07-01 --sink sqlite --output rerun    the daily reports as they were on 1 July 2025
+    python main.py --reports combined_sales_report report_three_combined --workers 1
 
-    COLUMNS of TUTLIV.dbo.ING_SALES:
-    ISBN    YEAR    MONTH   TITLE   NAMECUST    NETUNITS    NETAMT
-    """
-    ingram_sales_df = pl.from_pandas(pd.read_sql(ING_QUERY, engine)) #Query is in src/helpers/paths.py
+--reports picks from REPORTS (DAILY_REPORTS by default). Only the sources the picked reports read are fetched, all at once
+(helpers/scheduler.prefetch), the sales cube is built from them and the reports run side by side on --workers threads.
 
-    """
-    Next, grab all SAGE Sales data for the last 3 years not including current month, also include no sales where namecust LIKE 'INGRAM BOOK CO.'
+--as-of is the run date every report computes its windows from (YTD, last 12 months, prior years). Its month is the open
+month: ING_SALES is read up to the month before it and the cube is cut there, so a past date reruns the reports on the
+months that were closed then. SAGE_QUERY (helpers/paths.py) has to cover the years before it.
 
-    COLUMNS of TUTLIV.dbo.ALL_HSA_MKSEG:
-    NETAMT    NETUNITS     NEWBILLTO    ISBN    YEAR    MONTH   TITLE   NAMECUST    IDACCTSET 
-    """
-    sage_sales_df = pl.from_pandas(pd.read_sql(SAGE_QUERY, engine)) #Query is in src/helpers/paths.py
-    
-    """
-    Get target calculations df reading from excel
-    """
-    target_calculations_df = pl.from_pandas(pd.read_excel(TARGET_CALCULATIONS_FILE,sheet_name = 'Sheet1',dtype={
+--sink is where the report tables go (helpers/sinks.py): sqlserver publishes to TUTLIV, parquet and sqlite write under
+--output. The mapping uploads only run with the sqlserver sink (and not with --skip-uploads), a dry run writes nothing to
+TUTLIV. Exits with 1 when any report failed.
+
+--write-inputs DIR stops after the fetch: the sales cube and the lookups the reports read are written to DIR as Parquet
+(helpers/handoff.py) and the manifest path is printed. --read-inputs <manifest> runs the reports on those files instead of
+fetching, with the as-of date of the fetch. The Airflow DAG runs one fetch and then one process per report this way:
+
+    python main.py --skip-uploads --reports combined_sales_report report_three_combined --write-inputs handoff/20250701
+    python main.py --skip-uploads --reports combined_sales_report --read-inputs handoff/20250701/_inputs.json
+"""
+
+DAILY_REPORTS = ['combined_sales_report', 'report_three_combined']
+
+#name: (sources the report reads, how it runs on the run's inputs)
+REPORTS = {
+    'combined_sales_report': (['INGRAM', 'SAGE', 'ALL_ACCOUNTS_12M_ROLL', 'BOOK_DETAILS'], lambda run: combined_sales_report(
+        sales_cube = run['SALES_CUBE'],
+        tutliv_engine = run['engine'],
+        all_accounts_df = run['ALL_ACCOUNTS_12M_ROLL'],
+        book_details_df = run['BOOK_DETAILS'],
+        as_of = run['as_of'],
+        sink = run['sink']
+    )),
+    'report_three_combined': (['INGRAM', 'SAGE', 'TARGETS', 'ARCUS'], lambda run: report_three_combined(
+        sales_cube = run['SALES_CUBE'],
+        target_calculations_df = run['TARGETS'],
+        tutliv_engine = run['engine'],
+        customer_city_state = run['ARCUS'],
+        as_of = run['as_of'],
+        sink = run['sink']
+    )),
+    #Ingram's own customer names, not the Sage names ING_QUERY maps them to
+    'ingram_only_pipeline': (['ING_SALES'], lambda run: ingram_only_pipeline.main(
+        sales_cube = run['INGRAM_ONLY_CUBE'],
+        tutliv_engine = run['engine'],
+        as_of = run['as_of'],
+        sink = run['sink']
+    )),
+    #reads BOOK_LEVEL_SALES itself
+    'book_level_reports': ([], lambda run: run_all_book_reports(
+        tutliv_engine = run['engine'],
+        as_of = run['as_of'],
+        sink = run['sink']
+    ))
+}
+
+#cube: {source: build_sales_cube argument}, the reports read the cubes built from these sources, not the sales rows
+CUBES = {
+    'SALES_CUBE': {'INGRAM': 'ingram_sales_df', 'SAGE': 'sage_sales_df'},
+    'INGRAM_ONLY_CUBE': {'ING_SALES': 'ingram_sales_df'}
+}
+SALES_SOURCES = [source for sources in CUBES.values() for source in sources]
+
+
+def read_target_calculations() -> pl.DataFrame:
+    return pl.from_pandas(pd.read_excel(TARGET_CALCULATIONS_FILE,sheet_name = 'Sheet1',dtype={
         "BILLTO": str,
         "COMPANY" : str,
         "2024" : float,
         "2025" : float,
-        "MUL_RATIO" : float
+        "MUL_RATIO" : float,
+        "Dupe?" : str
     }))
 
-    logger.info("Starting generation of COMBINED_SALES_REPORT")
-    #combined_sales_report(ingram_sales_df = ingram_sales_df,sage_sales_df = sage_sales_df, tutliv_engine=engine)
-    logger.info("Finished combining data and reporting logic for COMBINED_SALES_REPORT")
-    logger.info("Starting REPORT_THREE_COMBINED")
-    #report_three_combined(ingram_sales_df = ingram_sales_df,sage_sales_df = sage_sales_df,target_calculations_df = target_calculations_df,tutliv_engine = engine)
-    logger.info("Finished REPORT_THREE_COMBINED")
 
-    logger.info('starting revenue report')
-    #revenue_report(ing_sales_df=ingram_sales_df,sage_sales_df=sage_sales_df,tutliv_engine=engine)
-    logger.info('finished revenue report')
-    logger.info("Program has finished")
+def source_reads(engine, as_of: datetime.date) -> dict:
+    """
+    INGRAM: the rows of ING_QUERY (Ingram names mapped to Sage names, categories joined) for the last 3 years up to the
+    month before as_of, from its local YEARMONTH snapshot (only months past its watermark are fetched, all of them again
+    when the name mapping or category tables changed)
+    ING_SALES: the same months of TUTLIV.dbo.ING_SALES with Ingram's own names, for ingram_only_pipeline
+    COLUMNS of TUTLIV.dbo.ING_SALES:
+    ISBN    YEAR    MONTH   TITLE   NAMECUST    NETUNITS    NETAMT
+
+    SAGE: all SAGE Sales data for the last 3 years not including current month, also include no sales where namecust LIKE 'INGRAM BOOK CO.'
+    COLUMNS of TUTLIV.dbo.ALL_HSA_MKSEG:
+    NETAMT    NETUNITS     NEWBILLTO    ISBN    YEAR    MONTH   TITLE   NAMECUST    IDACCTSET
+
+    Both sales reads are summed on SQL Server to the grain the sales cube needs (helpers/query_builder.py)
+    TARGETS: target calculations read from excel
+    ARCUS, ALL_ACCOUNTS_12M_ROLL and BOOK_DETAILS: lookups joined on by the reports
+    """
+    return {
+        'INGRAM': lambda: load_ing_query_sales(engine, as_of = as_of), #Query is in src/helpers/paths.py
+        'ING_SALES': lambda: load_ing_sales(engine, as_of = as_of),
+        'SAGE': lambda: apply_dtype_policy(read_aggregated(SAGE_QUERY, engine, SAGE_GRAIN), name = 'SAGE_SALES'), #Query is in src/helpers/paths.py
+        'TARGETS': read_target_calculations,
+        'ARCUS': lambda: fetch_customer_city_state(engine),
+        'ALL_ACCOUNTS_12M_ROLL': lambda: fetch_all_accounts(engine),
+        'BOOK_DETAILS': lambda: fetch_book_details(engine)
+    }
+
+
+def input_names(reports: list) -> list:
+    #the reports read the sales cubes built from the sales sources, not the sales rows themselves
+    needed = {source for report in reports for source in REPORTS[report][0]}
+    return sorted(needed - set(SALES_SOURCES)) + [cube for cube, sources in CUBES.items() if needed & set(sources)]
+
+
+def fetch_inputs(reports: list, engine, as_of: datetime.date) -> dict:
+    """
+    Every input the reports read, fetched all at once against the engine's pool, with the sales cubes built from the
+    sales rows and cut at the as_of month.
+    """
+    needed = {source for report in reports for source in REPORTS[report][0]}
+    reads = {name: read for name, read in source_reads(engine, as_of).items() if name in needed}
+    if not reads:
+        return {}
+    with stage('RUN', 'fetch') as s:
+        inputs = prefetch(reads)
+        s['rows_out'] = sum(len(df) for df in inputs.values())
+
+    for cube, sources in CUBES.items():
+        if not needed & set(sources):
+            continue
+        #Normalize and aggregate the sales rows once, every report rolls up from its cube
+        logger.info(f"Building {cube}")
+        partition_dir = os.path.join(SALES_CUBE_PARTITIONS, cube.lower()) if SALES_CUBE_PARTITIONS else None
+        sales_cube = build_sales_cube(**{argument: inputs.get(source) for source, argument in sources.items()}, partition_dir = partition_dir)
+        inputs[cube] = closed_months(sales_cube, as_of)
+    return {name: inputs[name] for name in input_names(reports)}
+
+
+def parse_args(argv: list = None, default_reports: list = DAILY_REPORTS, default_log_file: str = LOG_FILE) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description = 'Build the sales reports and write them to SQL Server, Parquet or SQLite')
+    parser.add_argument('--reports', nargs = '+', choices = list(REPORTS), default = default_reports, metavar = 'REPORT',
+                        help = f"any of {', '.join(REPORTS)} (default: {' '.join(default_reports)})")
+    parser.add_argument('--as-of', type = datetime.date.fromisoformat, default = datetime.date.today(), help = 'run date YYYY-MM-DD, default: today')
+    parser.add_argument('--workers', type = int, default = REPORT_WORKERS, help = 'reports run at the same time')
+    parser.add_argument('--sink', choices = SINKS, default = 'sqlserver')
+    parser.add_argument('--output', default = DRY_RUN_DIR, help = 'directory the parquet and sqlite sinks write to')
+    parser.add_argument('--skip-uploads', action = 'store_true', help = 'do not run the name and category mapping uploads')
+    parser.add_argument('--log-file', default = default_log_file)
+    parser.add_argument('--run-id', help = 'names the run metrics file, default: the start time (set it when runs start side by side)')
+    handoff = parser.add_mutually_exclusive_group()
+    handoff.add_argument('--write-inputs', metavar = 'DIR', help = 'only fetch the inputs of --reports into DIR as Parquet and print the manifest path')
+    handoff.add_argument('--read-inputs', metavar = 'MANIFEST', help = 'run --reports on inputs written by --write-inputs instead of fetching them')
+    return parser.parse_args(argv)
 
-    engine.dispose() #close engine.
+
+def run(args: argparse.Namespace) -> int:
+    if args.run_id:
+        instrumentation.reset(args.run_id)
+    engine = get_engine()
+    as_of = args.as_of
+
+    #run name mapping and category mapping upload, each skips itself when its workbook has not changed (helpers/upload_manifest.py)
+    if args.sink == 'sqlserver' and not args.skip_uploads:
+        #each upload records its own fetch and upload stages
+        logger.info("Starting upload of name mapping")
+        name_mapping_upload()
+        logger.info("Starting upload of category mapping")
+        category_mapping_upload()
+
+    if args.read_inputs:
+        #the fetch decided the run date, the cube was cut at it
+        inputs, as_of = read_inputs(args.read_inputs, input_names(args.reports))
+    else:
+        inputs = fetch_inputs(args.reports, engine, as_of)
+
+    if args.write_inputs:
+        manifest_path = write_inputs(inputs, args.write_inputs, as_of)
+        finish_run("logs_and_tests")
+        #last line of stdout, Airflow pushes it to XCom
+        print(manifest_path)
+        return 0
+
+    logger.info(f"Running {', '.join(args.reports)} as of {as_of} on {args.workers} workers, writing to {args.sink}")
+    inputs.update({'engine': engine, 'as_of': as_of, 'sink': make_sink(args.sink, engine = engine, directory = args.output)})
+
+    #the reports only read their inputs, run them side by side so their SQL Server waits overlap
+    report_summary = run_reports({report: lambda report = report: REPORTS[report][1](inputs) for report in args.reports}, max_workers = args.workers)
+    logger.info("Run has finished")
+
+    finish_run("logs_and_tests", engine if args.sink == 'sqlserver' else None)
+
+    return 1 if failed_reports(report_summary) else 0
+
+
+def configure_logging(log_file: str) -> None:
+    #force replaces any handlers an imported module configured, every record goes to log_file
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file, mode='w'),
+            logging.StreamHandler(sys.stdout)
+        ],
+        force=True
+    )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure_logging(args.log_file)
+    exit_code = run(args)
+    dispose_engine() #close engine.
     time.sleep(3)
-    sys.exit(0)
+    sys.exit(exit_code)
@@ -1,14 +1,15 @@
 import pandas as pd
 import polars as pl
-import sqlalchemy
 from sqlalchemy.engine import Engine
-from sqlalchemy import inspect
 import os,sys
 import logging
 import datetime
-from sqlalchemy.exc import SQLAlchemyError, OperationalError
-from polars.exceptions import ComputeError
+from sqlalchemy.exc import SQLAlchemyError
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from helpers.sinks import sql_server_sink
+from helpers.instrumentation import stage
+from helpers.isbn import normalize_isbns
+from helpers.dtypes import apply_dtype_policy, amount_total
 """
 Book Level report, do not need to get sage sales at all for any of these books.
 revenue_report makes REVENUE_REPORT table
@@ -20,11 +21,11 @@ report_b makes REPORT_B table
 logger = logging.getLogger(__name__)
 
 
-def revenue_report(ing_sales_df: pl.DataFrame,book_details_df: pl.DataFrame,backorder_report_df: pl.DataFrame,tutliv_engine: Engine) -> None:
+def revenue_report(ing_sales_df: pl.DataFrame,book_details_df: pl.DataFrame,backorder_report_df: pl.DataFrame,tutliv_engine: Engine,as_of: datetime.date = None,sink = None) -> None:
 
     """
     Columns of ing_sales_df will be
-    ISBN, NETAMT, NETQTY, YEARMONTH,TITLE
+    ISBN, NETAMT (NETAMT_CENTS under the compact dtype policy), NETQTY, YEARMONTH,TITLE
 
     COLUMNS of book_details will be 
     TRIM([ISBN]),
@@ -42,10 +43,11 @@ def revenue_report(ing_sales_df: pl.DataFrame,book_details_df: pl.DataFrame,back
     backorder_report_columns:
     ISBN,TITLE,QTYBO
 
-
+    as_of is the run date, the windows end before its month (today when not passed). The table goes to sink
+    (helpers/sinks.py), published to SQL Server through tutliv_engine when not passed.
     """
 
-    curr_date = datetime.datetime.now()
+    curr_date = as_of or datetime.date.today()
     curr_month = curr_date.month
     curr_year = curr_date.year
 
@@ -55,9 +57,11 @@ def revenue_report(ing_sales_df: pl.DataFrame,book_details_df: pl.DataFrame,back
     backorder_report_df = backorder_report_df.select(['ISBN','TITLE','QTYBO'])
 
     
+    #back to dollars here, the ingest may have stored NETAMT as NETAMT_CENTS (helpers/dtypes.py)
     grouped_df = ing_sales_df.group_by(['ISBN','TITLE','YEARMONTH']).agg([
-        pl.col('NETAMT').sum().alias('NETAMT'),
-        pl.col('NETQTY').sum().alias('NETQTY')
+        amount_total('NETAMT', ing_sales_df.columns),
+        #Int32 sums wrap instead of widening
+        pl.col('NETQTY').cast(pl.Int64).sum().alias('NETQTY')
     ])
 
     #base df is every possible combination of ISBN and TITLE, time series will be joined.
@@ -132,9 +136,9 @@ def revenue_report(ing_sales_df: pl.DataFrame,book_details_df: pl.DataFrame,back
     #join backorder report
     report_df = report_df.join(backorder_report_df,on = ['ISBN','TITLE'], how = 'left')
 
-    prod_df = report_df.to_pandas()
-
-    prod_df.to_sql('REVENUE_REPORT',index=False,con= tutliv_engine,if_exists='replace',schema='dbo')
+    with stage('REVENUE_REPORT', 'upload', rows_in = len(report_df)) as s:
+        publish = sink or sql_server_sink(tutliv_engine)
+        s['rows_out'] = publish(report_df,'REVENUE_REPORT',schema='dbo',indexes=[['ISBN']])
 
 def report_a(sage_sales_df: pl.DataFrame, book_details_df: pl.DataFrame,backorder_report_df: pl.DataFrame,tutliv_engine: Engine):
     pass
@@ -143,11 +147,12 @@ def report_b(sage_sales_df: pl.DataFrame, book_details_df: pl.DataFrame,backorde
     pass
 
 
-def run_all_book_reports(tutliv_engine: Engine):
+def run_all_book_reports(tutliv_engine: Engine, as_of: datetime.date = None, sink = None):
     """
     to get book level data we will select * FROM BOOK_LEVEL_SALES view in SQL SERVER where
     YEAR is from 10 years ago until now.
     We will then dynamically select 
+    as_of and sink are passed on to every report.
     """
 
     try:
@@ -240,16 +245,13 @@ def run_all_book_reports(tutliv_engine: Engine):
 
     #cast types once before passing
 
-    ing_sales_df = ing_sales_df.with_columns(
+    #NETAMT used to be cast to Int64, which dropped the cents of every row, the dtype policy keeps it exact (in cents)
+    ing_sales_df = apply_dtype_policy(ing_sales_df.with_columns(
         pl.col('ISBN').cast(pl.Utf8),
         pl.col('TITLE').cast(pl.Utf8),
-        pl.col('YEAR').cast(pl.Int32),
-        pl.col('MONTH').cast(pl.Int32),
-        pl.col('NETAMT').cast(pl.Int64),
-        pl.col('NETQTY').cast(pl.Float64)
-    ).with_columns(
-        (pl.col('YEAR') * 100 + pl.col('MONTH').cast(pl.Int64).alias('YEARMONTH'))
-    ).drop(['YEAR','MONTH'])
+        (pl.col('YEAR').cast(pl.Int32) * 100 + pl.col('MONTH').cast(pl.Int32)).alias('YEARMONTH')
+    ).drop(['YEAR','MONTH']), name = 'BOOK_LEVEL_SALES')
+    ing_sales_df = normalize_isbns(ing_sales_df, 'ISBN')
 
     book_details_df = book_details_df.with_columns(
         pl.col('ISBN').cast(pl.Utf8),
@@ -277,15 +279,17 @@ def run_all_book_reports(tutliv_engine: Engine):
         pl.col('EXPDATE').cast(pl.Utf8),
         pl.col('SELLOFF').cast(pl.Utf8)
     )
+    book_details_df = normalize_isbns(book_details_df, 'ISBN')
 
     backorder_report_df = backorder_report_df.with_columns(
         pl.col('ISBN').cast(pl.Utf8),
         pl.col('QTYBO').cast(pl.Int32)
     )
+    backorder_report_df = normalize_isbns(backorder_report_df, 'ISBN')
 
     #now we can run each report one by one
     logger.info('Beginning Revenue Reporet')
-    revenue_report(ing_sales_df = ing_sales_df, book_details_df = book_details_df, backorder_report_df = backorder_report_df,tutliv_engine = tutliv_engine)
+    revenue_report(ing_sales_df = ing_sales_df, book_details_df = book_details_df, backorder_report_df = backorder_report_df,tutliv_engine = tutliv_engine,as_of = as_of,sink = sink)
     logger.info('Finished revenue report')
 
     logger.info('Beggining report_a')
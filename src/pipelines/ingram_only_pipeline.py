@@ -1,274 +1,205 @@
 #type: ignore
-import urllib.parse
-import pandas as pd
 import polars as pl
-import sqlalchemy
 import os
-import urllib,logging,sys
-import pyodbc
-import xlwings as xw
+import logging,sys
 import datetime
-import pyarrow
 sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from helpers.paths import PATHS
-
-
-logging.basicConfig(
-    level=logging.INFO,
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('logs_and_tests/ingram_only_pipeline.log',mode = 'w')
-    ]
-)
-
-SSMS_CONN_STRING = PATHS['SSMS_CONN_STRING']
-
-params = urllib.parse.quote_plus(SSMS_CONN_STRING)
-engine = sqlalchemy.create_engine(f"mssql+pyodbc:///?odbc_connect={params}",connect_args={'timeout':1800,'connect_timeout':120},pool_recycle=3600)
-
-#Get INGRAM sales mapping / needed data
-def main():
+from helpers.engine import get_engine
+from helpers.sql_reader import read_sql_polars
+from helpers.ing_sales_snapshot import load_ing_sales
+from helpers.sinks import sql_server_sink
+from helpers.instrumentation import stage
+from helpers.isbn import normalize_isbns
+from helpers.pivot import trailing_year_months, month_sum, months_sum, year_sum, pivot_windows, null_key_rows_to
+from pipelines.sales_cube import INGRAM, COLUMN_ALIASES, build_sales_cube, source_rows
+
+
+REPORT_NAME = 'COMBINED_REPORT_INGRAM_ONLY'
+REPORT_KEYS = ['ISBN','TITLE','NAMECUST','HQ_NUMBER','SL_NUMBER','IPS_SALE','TUTTLE_SALES_CATEGORY']
+#monthly units are summed over every customer name on the account
+MONTHLY_KEYS = ['ISBN','TITLE','HQ_NUMBER','SL_NUMBER','IPS_SALE','TUTTLE_SALES_CATEGORY']
+
+months_dict = {
+    1: 'Jan',
+    2: 'Feb',
+    3: 'Mar',
+    4: 'Apr',
+    5: 'May',
+    6: 'Jun',
+    7: 'Jul',
+    8: 'Aug',
+    9: 'Sep',
+    10: 'Oct',
+    11: 'Nov',
+    12: 'Dec'
+}
+
+def yyyymm_to_units_col(yyyymm):
+    year = yyyymm // 100
+    month = yyyymm % 100
+    return f"NET_UNITS_{months_dict[month]}_{year}"
+
+def fetch_ingram_sales(engine, as_of: datetime.date = None) -> pl.DataFrame:
     try:
-        ingram_sales_df = pl.from_pandas(pd.read_sql(
-        """
-            DECLARE @start_year INT, @curr_month VARCHAR(6);
-
-            SET @start_year = YEAR(DATEADD(YEAR,-3,GETDATE()));
-            SET @curr_month = FORMAT(GETDATE(),'yyyyMM');
-
-            SELECT
-                TRIM(ING_SALES.ISBN) AS ISBN,
-                TRIM(ING_SALES.TITLE) AS TITLE,
-                TRIM(ING_SALES.NAMECUST) AS NAMECUST,
-                ING_SALES.YEAR AS YEAR,
-                ING_SALES.MONTH AS MONTH,
-                TRIM(ING_SALES.[IPS Sale]) AS [IPS Sale],
-                ING_SALES.NETUNITS AS NETUNITS,
-                ING_SALES.NETAMT AS NETAMT,
-                ING_SALES.[HQ Account Number],
-                ING_SALES.[SL Account Number],
-                ING_CAT.[MASTER SALES CATEGORY] as TUTTLE_SALES_CATEGORY
-            FROM TUTLIV.dbo.ING_SALES AS ING_SALES
-            LEFT JOIN (
-                SELECT DISTINCT
-                    TRIM([SL Account Number]) AS [SL Account Number],
-                    TRIM([HQ Account Number]) AS [HQ Account Number],
-                    TRIM([MASTER SALES CATEGORY]) AS [MASTER SALES CATEGORY]
-                FROM TUTLIV.dbo.INGRAM_MASTER_CATEGORIES
-            ) AS ING_CAT
-                ON TRIM(ING_SALES.[SL Account Number]) = ING_CAT.[SL Account Number]
-            AND TRIM(ING_SALES.[HQ Account Number]) = ING_CAT.[HQ Account Number]
-            WHERE
-                ING_SALES.YEAR > @start_year
-                AND (ING_SALES.YEAR * 100 + ING_SALES.MONTH) != CAST(@curr_month AS INT);
-        """,engine))
+        ingram_sales_df = load_ing_sales(engine, as_of = as_of)
         logging.info(f'Successfully grabbed {len(ingram_sales_df)} records from SQL server table TUTLIV.dbo.ING_SALES')
     except Exception as error:
         logging.error(f"failed to get ingram sales {error}")
+    return ingram_sales_df
 
-    ingram_sales_df = ingram_sales_df.with_columns(
-        pl.col('ISBN').cast(pl.Utf8),
-        pl.col('TITLE').cast(pl.Utf8),
-        pl.col('NAMECUST').cast(pl.Utf8),
-        pl.col('YEAR').cast(pl.Int32),
-        pl.col('MONTH').cast(pl.Int32),
-        pl.col('IPS Sale').cast(pl.Utf8),
-        pl.col('NETUNITS').cast(pl.Int32),
-        pl.col('NETAMT').cast(pl.Float32),
-        pl.col('HQ Account Number').cast(pl.Utf8),
-        pl.col('SL Account Number').cast(pl.Utf8)
-    )
-
-    base_df = ingram_sales_df.group_by(['ISBN','TITLE','NAMECUST','HQ Account Number','SL Account Number','IPS Sale','TUTTLE_SALES_CATEGORY']).agg([])
-    report_df = base_df.clone()
-
-    total_sales_before,total_units_before = ingram_sales_df.select(pl.col('NETAMT').sum(),pl.col('NETUNITS').sum()).row(0)
-
-    logging.info(f'Total sales before processing: {total_sales_before}, Total units before processing: {total_units_before}')
-
-    #12 Month rolling logic
-    curr_dt = datetime.datetime.now()
-
-    curr_month = curr_dt.month
-    curr_year = curr_dt.year
-    rolling_twelve_months_yyyymm = []
-
-    months_dict = {
-        1: 'Jan',
-        2: 'Feb',
-        3: 'Mar',
-        4: 'Apr',
-        5: 'May',
-        6: 'Jun',
-        7: 'Jul',
-        8: 'Aug',
-        9: 'Sep',
-        10: 'Oct',
-        11: 'Nov',
-        12: 'Dec'
-    }
-
-    def yyyymm_to_units_col(yyyymm):
-        year = yyyymm // 100
-        month = yyyymm % 100
-        return f"NET_UNITS_{months_dict[month]}_{year}"
-
-    #monthly units logic
-    
-    for i in range(1,13):
-        calc_month = curr_month - i
-        rolling_year = curr_year
-        if calc_month <= 0:
-            rolling_year -= 1
-            calc_month += 12
-        year_month = rolling_year*100 + calc_month
-        rolling_twelve_months_yyyymm.append((year_month))
-        col_name = yyyymm_to_units_col(year_month)
-        #do individual joins for net units per each month  12m-rolling
-        calc_month_net_units = (ingram_sales_df
-            .filter((pl.col('YEAR') * 100 + pl.col('MONTH')) == (year_month))
-            .group_by(['ISBN','TITLE','HQ Account Number','SL Account Number','IPS Sale','TUTTLE_SALES_CATEGORY'])
-            .agg(
-                pl.col('NETUNITS').sum().alias(col_name)
-            ))
-        calc_month_net_units = calc_month_net_units.fill_null(0)
+#Get INGRAM sales mapping / needed data
+def main(sales_cube: pl.DataFrame = None, tutliv_engine = None, as_of: datetime.date = None, sink = None):
+    """
+    sales_cube comes from pipelines/sales_cube.build_sales_cube and must carry IPS_SALE for its Ingram rows.
+    When it is not passed ING_SALES is read here and the cube is built from those rows.
+    tutliv_engine defaults to the shared engine from helpers/engine.py.
+    as_of is the run date, the windows end before its month (today when not passed). The report table goes to
+    sink (helpers/sinks.py), published to SQL Server when not passed.
+    """
+    engine = tutliv_engine or get_engine()
+    if sales_cube is None:
+        with stage(REPORT_NAME, 'fetch') as s:
+            sales_cube = build_sales_cube(ingram_sales_df = fetch_ingram_sales(engine, as_of))
+            s['rows_out'] = len(sales_cube)
+
+    with stage(REPORT_NAME, 'aggregate', rows_in = len(sales_cube)) as s:
+        ingram_sales_df = source_rows(sales_cube, INGRAM)
+
+        total_sales_before,total_units_before = ingram_sales_df.select(pl.col('NETAMT').sum(),pl.col('NETUNITS').sum()).row(0)
+
+        logging.info(f'Total sales before processing: {total_sales_before}, Total units before processing: {total_units_before}')
+
+        #12 Month rolling logic
+        curr_dt = as_of or datetime.date.today()
+
+        curr_month = curr_dt.month
+        curr_year = curr_dt.year
+        rolling_twelve_months_yyyymm = trailing_year_months(curr_year, curr_month)
+
+        #individual accounts 12rolling logic and prev 3 years logic, one pass over the cube
+        yearly_units_cols = [f'NET_UNITS_{year}' for year in range(curr_year-1,curr_year-4,-1)]
+        account_window_expressions = [
+            months_sum('NETUNITS', rolling_twelve_months_yyyymm, '12M_UNITS'),
+            months_sum('NETAMT', rolling_twelve_months_yyyymm, '12M_DOLLARS')
+        ] + [year_sum('NETUNITS', int(col[-4:]), col) for col in yearly_units_cols]
+
+        report_df = pivot_windows(ingram_sales_df, REPORT_KEYS, account_window_expressions)
+        report_df = null_key_rows_to(report_df, REPORT_KEYS, ['12M_UNITS','12M_DOLLARS'] + yearly_units_cols, 0)
+
+        #monthly units logic
+        monthly_units_cols = [yyyymm_to_units_col(year_month) for year_month in rolling_twelve_months_yyyymm]
+        monthly_net_units = pivot_windows(ingram_sales_df, MONTHLY_KEYS, [
+            month_sum('NETUNITS', year_month, col) for year_month, col in zip(rolling_twelve_months_yyyymm, monthly_units_cols)
+        ])
         report_df = report_df.join(
-            calc_month_net_units,
-            on = ['ISBN','TITLE','HQ Account Number','SL Account Number','IPS Sale','TUTTLE_SALES_CATEGORY'],
+            monthly_net_units,
+            on = MONTHLY_KEYS,
             how='left')
 
-    #all accounts 12m rolling
-    all_accounts_twelve_months_rolling = (ingram_sales_df.filter((pl.col('YEAR')* 100 + pl.col('MONTH'))
-        .is_in(rolling_twelve_months_yyyymm))
-        .group_by(['ISBN','TITLE'])
-        .agg(
-            pl.col('NETUNITS').sum().alias('ALL_ACCTS_12M_UNITS'),
-            pl.col('NETAMT').sum().alias('ALL_ACCTS_12M_DOLLARS')
-    ))
-    all_accounts_twelve_months_rolling = all_accounts_twelve_months_rolling.fill_null(0)
-
-    report_df = report_df.join(
-        all_accounts_twelve_months_rolling,
-        on = ['ISBN','TITLE'],
-        how = 'left'
-    )
+        #all accounts 12m rolling
+        all_accounts_twelve_months_rolling = pivot_windows(ingram_sales_df, ['ISBN','TITLE'], [
+            months_sum('NETUNITS', rolling_twelve_months_yyyymm, 'ALL_ACCTS_12M_UNITS'),
+            months_sum('NETAMT', rolling_twelve_months_yyyymm, 'ALL_ACCTS_12M_DOLLARS')
+        ])
 
-    #individual accounts 12rolling logic
-    individual_accounts_twelve_months_rolling = (ingram_sales_df.filter((pl.col('YEAR')*100 + pl.col('MONTH'))
-        .is_in(rolling_twelve_months_yyyymm))
-        .group_by(['ISBN','TITLE','NAMECUST','HQ Account Number','SL Account Number','IPS Sale','TUTTLE_SALES_CATEGORY'])
-        .agg(
-            pl.col('NETUNITS').sum().alias('12M_UNITS'),
-            pl.col('NETAMT').sum().alias('12M_DOLLARS')
-        ))
-    individual_accounts_twelve_months_rolling = individual_accounts_twelve_months_rolling.fill_null(0)
-
-    report_df = report_df.join(
-        individual_accounts_twelve_months_rolling,
-        on = ['ISBN','TITLE','NAMECUST','HQ Account Number','SL Account Number','IPS Sale','TUTTLE_SALES_CATEGORY'],
-        how = 'left'
-    )
-
-    #ytd logic (curr_year line 73)
-    year_to_date = (ingram_sales_df.filter(pl.col('YEAR') == curr_year)
-        .group_by(['ISBN','TITLE','NAMECUST','HQ Account Number','SL Account Number','IPS Sale','TUTTLE_SALES_CATEGORY'])
-        .agg(
-            pl.col('NETUNITS').sum().alias('YTD_UNITS'),
-            pl.col('NETAMT').sum().alias('YTD_DOLLARS')
-        ))
-
-    #prev 3 years logic
-    base_year = datetime.datetime.now().year
-    for year in range(base_year-1,base_year-4,-1):
-        year_units = (ingram_sales_df.filter(pl.col('YEAR') == year)
-            .group_by(['ISBN','TITLE','NAMECUST','HQ Account Number','SL Account Number','IPS Sale','TUTTLE_SALES_CATEGORY'])
-            .agg(
-                pl.col('NETUNITS').sum().alias(f'NET_UNITS_{year}')
-            ))
-        year_units = year_units.fill_null(0)
         report_df = report_df.join(
-            year_units,
-            on = ['ISBN','TITLE','NAMECUST','HQ Account Number','SL Account Number','IPS Sale','TUTTLE_SALES_CATEGORY'],
+            all_accounts_twelve_months_rolling,
+            on = ['ISBN','TITLE'],
             how = 'left'
         )
 
-    #get book metadata
+        report_df = report_df.rename({new: old for old, new in COLUMN_ALIASES.items()})
+        s['rows_out'] = len(report_df)
 
-    book_data = pl.from_pandas(pd.read_sql(
-        """
-        SELECT
-            TRIM(ISBN) as ISBN,
-            TRIM(PROD_TYPE) as PROD_TYPE,
-            TRIM(PROD_CLASS) as PROD_CLASS,
-            TRIM(SEAS) as SEAS,
-            TRIM(SUBPUB) as SUBPUB,
-            TRIM(WEBCAT2) as WEBCAT2,
-            TRIM(WEBCAT2_DESCR) as WEBCAT2_DESCR,
-            RETAIL_PRICE
-        FROM TUTLIV.dbo.BOOK_DETAILS
-        """,engine))
-
-    report_df = report_df.join(
-        book_data,
-        on = ['ISBN'],
-        how = 'left'
-    )
+    #get book metadata
 
-    final_order = [
-        "NAMECUST",
-        "HQ Account Number",
-        "SL Account Number",
-        "IPS Sale",
-        "TUTTLE_SALES_CATEGORY",
-        "ISBN",
-        "TITLE",
-        "PROD_TYPE",
-        "PROD_CLASS",
-        "SEAS",
-        "SUBPUB",
-        "WEBCAT2",
-        "WEBCAT2_DESCR",
-        "RETAIL_PRICE",
+    with stage(REPORT_NAME, 'fetch') as s:
+        book_data = normalize_isbns(read_sql_polars(
+            """
+            SELECT
+                TRIM(ISBN) as ISBN,
+                TRIM(PROD_TYPE) as PROD_TYPE,
+                TRIM(PROD_CLASS) as PROD_CLASS,
+                TRIM(SEAS) as SEAS,
+                TRIM(SUBPUB) as SUBPUB,
+                TRIM(WEBCAT2) as WEBCAT2,
+                TRIM(WEBCAT2_DESCR) as WEBCAT2_DESCR,
+                RETAIL_PRICE
+            FROM TUTLIV.dbo.BOOK_DETAILS
+            """,engine), 'ISBN')
+        s['rows_out'] = len(book_data)
+
+    with stage(REPORT_NAME, 'join', rows_in = len(report_df)) as s:
+        report_df = report_df.join(
+            book_data,
+            on = ['ISBN'],
+            how = 'left'
+        )
+        s['rows_out'] = len(report_df)
 
+    with stage(REPORT_NAME, 'enrich', rows_in = len(report_df)) as s:
+        final_order = [
+            "NAMECUST",
+            "HQ Account Number",
+            "SL Account Number",
+            "IPS Sale",
+            "TUTTLE_SALES_CATEGORY",
+            "ISBN",
+            "TITLE",
+            "PROD_TYPE",
+            "PROD_CLASS",
+            "SEAS",
+            "SUBPUB",
+            "WEBCAT2",
+            "WEBCAT2_DESCR",
+            "RETAIL_PRICE",
 
 
 
-        "12M_UNITS",
-        "12M_DOLLARS",
-        "YTD_UNITS",
-        "YTD_DOLLARS",
 
+            "12M_UNITS",
+            "12M_DOLLARS",
+            "YTD_UNITS",
+            "YTD_DOLLARS",
 
-        "ALL_ACCTS_12M_UNITS",
-        "ALL_ACCTS_12M_DOLLARS",
-    ]
 
-    # Dynamically add all NET_UNITS_ and UNITS_ columns in order of appearance
-    monthly_cols = [col for col in report_df.columns if col.startswith("NET_UNITS_")]
-    yearly_cols = [col for col in report_df.columns if col.startswith("UNITS_") and col[6:].isdigit()]
+            "ALL_ACCTS_12M_UNITS",
+            "ALL_ACCTS_12M_DOLLARS",
+        ]
 
+        # Monthly NET_UNITS_ columns (most recent first) then the yearly NET_UNITS_ columns
+        units_cols = monthly_units_cols + yearly_units_cols
 
-    already_included = set(final_order + monthly_cols + yearly_cols)
-    extra_cols = [col for col in report_df.columns if col not in already_included]
 
-    final_order = final_order + monthly_cols + yearly_cols + extra_cols
+        already_included = set(final_order + units_cols)
+        extra_cols = [col for col in report_df.columns if col not in already_included]
 
+        final_order = final_order + units_cols + extra_cols
 
-    report_df = report_df.select([col for col in final_order if col in report_df.columns])
 
-    report_df = report_df.fill_null(0)
+        report_df = report_df.select([col for col in final_order if col in report_df.columns])
 
-    report_df = report_df.to_pandas()
+        report_df = report_df.fill_null(0)
+        s['rows_out'] = len(report_df)
 
-    report_df.to_sql(
-        name = 'COMBINED_REPORT_INGRAM_ONLY',
-        schema = 'dbo',
-        if_exists = 'replace',
-        index = False,
-        con = engine
-    )
+    with stage(REPORT_NAME, 'upload', rows_in = len(report_df)) as s:
+        publish = sink or sql_server_sink(engine)
+        s['rows_out'] = publish(
+            report_df,
+            table_name = REPORT_NAME,
+            schema = 'dbo',
+            indexes = [['ISBN'], ['NAMECUST']]
+        )
 
 if __name__ == "__main__":
+    #only when run on its own, main.py sets up logging for the runs it starts
+    logging.basicConfig(
+        level=logging.INFO,
+        handlers=[
+            logging.StreamHandler(sys.stdout),
+            logging.FileHandler('logs_and_tests/ingram_only_pipeline.log',mode = 'w')
+        ]
+    )
     logging.info('staring proccess')
     main()
     logging.info('finished proccess')
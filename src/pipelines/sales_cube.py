@@ -0,0 +1,136 @@
+#type: ignore
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import polars as pl
+import logging
+from helpers.partitions import refresh_partitions
+from helpers.instrumentation import stage
+from helpers.isbn import normalize_isbns
+from helpers.categorical import encode_categoricals
+from helpers.dtypes import amount_dollars, amount_total, CENTS_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+"""
+The sales cube is built once per run from the raw Ingram and Sage sales rows, every report then rolls up from it
+instead of re-casting, re-stripping and re-grouping the same rows itself.
+
+COLUMNS of the sales cube:
+SOURCE    HQ_NUMBER    SL_NUMBER    SAGE_ID    IPS_SALE    ISBN    TITLE    NAMECUST    TUTTLE_SALES_CATEGORY    YEARMONTH    NETUNITS    NETAMT    NETAMT_INT    NETAMT_INT_ABS
+
+SOURCE is 'INGRAM' or 'SAGE'. Id columns a source does not have are null (Sage rows have no HQ_NUMBER, SL_NUMBER or IPS_SALE,
+Ingram rows have no SAGE_ID). NETUNITS and NETAMT are summed over everything else, so there is one row per
+dimension combination per YEARMONTH. NETAMT_INT is the sum of the source row amounts each truncated to whole dollars and
+NETAMT_INT_ABS the sum of their absolute values: report_three_combined works in whole dollars per source row, and its
+targets need the absolute amounts because abs() of a summed amount nets returns against sales.
+
+YEARMONTH is an Int32, NETUNITS, NETAMT_INT and NETAMT_INT_ABS Int64 and NETAMT Float64. Source rows ingested under the
+compact dtype policy (helpers/dtypes.py) carry NETAMT_CENTS, those are summed exactly as integers and only the totals
+become dollars, the cube itself is always in dollars.
+
+The source rows can be detail rows or rows already summed on SQL Server (helpers/query_builder.py), pre-aggregated rows
+carry their own NETAMT_INT and NETAMT_INT_ABS.
+"""
+
+INGRAM = 'INGRAM'
+SAGE = 'SAGE'
+SOURCE_ENUM = pl.Enum([INGRAM, SAGE])
+
+#bump when normalize_sales/aggregate_sales change what they produce, stored cube partitions are then rebuilt
+CUBE_VERSION = 5
+
+CUBE_ID_COLUMNS = ['HQ_NUMBER','SL_NUMBER','SAGE_ID','IPS_SALE']
+CUBE_STRING_COLUMNS = CUBE_ID_COLUMNS + ['ISBN','TITLE','NAMECUST','TUTTLE_SALES_CATEGORY']
+CUBE_DIMENSIONS = ['SOURCE'] + CUBE_STRING_COLUMNS + ['YEARMONTH']
+
+#the grain SAGE_QUERY is summed to on SQL Server, the cube re-groups it after normalizing
+SAGE_GRAIN = ['SAGE_ID','ISBN','TITLE','NAMECUST','TUTTLE_SALES_CATEGORY','YEAR','MONTH']
+
+#ING_SALES column names used by queries that select straight from the table
+COLUMN_ALIASES = {
+    'HQ Account Number': 'HQ_NUMBER',
+    'SL Account Number': 'SL_NUMBER',
+    'IPS Sale': 'IPS_SALE'
+}
+
+
+def normalize_sales(sales_df: pl.DataFrame, source: str) -> pl.LazyFrame:
+    """
+    Cast and strip one source's rows to the cube columns and derive YEARMONTH.
+    Expects at least ISBN, YEAR, MONTH, TITLE, NAMECUST, NETUNITS, NETAMT (or NETAMT_CENTS), TUTTLE_SALES_CATEGORY.
+    NETAMT_INT / NETAMT_INT_ABS are NETAMT truncated (and its abs) unless the rows were pre-aggregated with them.
+    """
+    sales_df = sales_df.rename({old: new for old, new in COLUMN_ALIASES.items() if old in sales_df.columns})
+    missing_columns = [col for col in CUBE_STRING_COLUMNS if col not in sales_df.columns]
+    #cents stay integers until they are summed, the truncation to whole dollars goes through Float64 like truncated()
+    cents = 'NETAMT' + CENTS_SUFFIX in sales_df.columns
+    whole_dollars = amount_dollars('NETAMT', sales_df.columns).cast(pl.Int64)
+
+    sales_lf = sales_df.lazy().with_columns(
+        [pl.lit(None, dtype=pl.Utf8).alias(col) for col in missing_columns]
+    ).select(
+        [pl.lit(source).alias('SOURCE')]
+        + [pl.col(col).cast(pl.Utf8).str.strip_chars() for col in CUBE_STRING_COLUMNS]
+        + [
+            (pl.col('YEAR').cast(pl.Int32) * 100 + pl.col('MONTH').cast(pl.Int32)).alias('YEARMONTH'),
+            pl.col('NETUNITS').cast(pl.Int64),
+            pl.col('NETAMT' + CENTS_SUFFIX) if cents else pl.col('NETAMT').cast(pl.Float64),
+            pl.col('NETAMT_INT').cast(pl.Int64) if 'NETAMT_INT' in sales_df.columns else whole_dollars.alias('NETAMT_INT'),
+            pl.col('NETAMT_INT_ABS').cast(pl.Int64) if 'NETAMT_INT_ABS' in sales_df.columns else whole_dollars.abs().alias('NETAMT_INT_ABS')
+        ]
+    )
+    #ISBNs are normalized once here, every report joins on the cube's ISBN
+    return normalize_isbns(sales_lf, 'ISBN')
+
+
+def aggregate_sales(sales_df: pl.DataFrame, source: str) -> pl.DataFrame:
+    sales_lf = normalize_sales(sales_df, source)
+    return sales_lf.group_by(CUBE_DIMENSIONS).agg([
+        pl.col('NETUNITS').sum().alias('NETUNITS'),
+        amount_total('NETAMT', sales_lf.collect_schema().names()),
+        pl.col('NETAMT_INT').sum().alias('NETAMT_INT'),
+        pl.col('NETAMT_INT_ABS').sum().alias('NETAMT_INT_ABS')
+    ]).collect()
+
+
+def build_sales_cube(ingram_sales_df: pl.DataFrame = None, sage_sales_df: pl.DataFrame = None, partition_dir: str = None) -> pl.DataFrame:
+    """
+    With partition_dir set, each source's cube rows are kept per YEARMONTH under partition_dir and only the months
+    whose source rows changed since the last run are re-aggregated (see helpers/partitions.py).
+    """
+    sources = [(INGRAM, ingram_sales_df), (SAGE, sage_sales_df)]
+    rows_in = sum(len(df) for source, df in sources if df is not None)
+
+    frames = []
+    for source, df in sources:
+        if df is None:
+            continue
+        with stage('SALES_CUBE', f"aggregate_{source}", rows_in = len(df)) as s:
+            if partition_dir is None:
+                frames.append(aggregate_sales(df, source))
+            else:
+                frames.append(refresh_partitions(
+                    name = f"sales_cube_{source}",
+                    rows = df,
+                    year_month = pl.col('YEAR').cast(pl.Int64) * 100 + pl.col('MONTH').cast(pl.Int64),
+                    build = lambda rows, source = source: aggregate_sales(rows, source),
+                    store_dir = partition_dir,
+                    version = CUBE_VERSION
+                ))
+            s['rows_out'] = len(frames[-1])
+
+    #the repeated string columns are dictionary encoded, the reports group and join on their codes (helpers/categorical.py)
+    sales_cube = encode_categoricals(pl.concat(frames)).with_columns(pl.col('SOURCE').cast(SOURCE_ENUM))
+
+    logger.info(f"Built sales cube: {rows_in} source rows -> {len(sales_cube)} cube rows")
+    return sales_cube
+
+
+def source_rows(sales_cube: pl.DataFrame, source: str) -> pl.DataFrame:
+    return sales_cube.filter(pl.col('SOURCE') == source)
+
+
+def closed_months(sales_cube: pl.DataFrame, as_of) -> pl.DataFrame:
+    #the month of as_of is still open, a rerun for a past date only sees the months that were closed on that date
+    return sales_cube.filter(pl.col('YEARMONTH') < as_of.year * 100 + as_of.month)